@@ -147,12 +147,60 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_URL = '/users/'
 
+SITE_URL = os.getenv('SITE_URL')  # Адрес сайта для ссылок в письмах, например https://example.com
+
 EMAIL_HOST = 'smtp.yandex.ru'
 EMAIL_PORT = 465
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_PASS')
 EMAIL_USE_SSL = True
 
+# Ограничения скорости отправки для почтовых аккаунтов (писем в секунду, минуту и сутки, 0 - без ограничения).
+# Счетчики хранятся в кеше и общие для всех процессов рассылки.
+EMAIL_RATE_LIMITS = {
+    EMAIL_HOST_USER: {
+        'second': int(os.getenv('EMAIL_RATE_PER_SECOND') or 0),
+        'minute': int(os.getenv('EMAIL_RATE_PER_MINUTE') or 0),
+        'day': int(os.getenv('EMAIL_RATE_PER_DAY') or 0),
+    },
+}
+EMAIL_RATE_MAX_WAIT = 60  # Дольше ожидать освобождения лимита не будем, письмо уйдет в очередь повторов
+# Доля лимитов, которую рассылки оставляют служебным письмам (регистрация, сброс пароля)
+NEWSLETTER_RESERVED_RATE = float(os.getenv('NEWSLETTER_RESERVED_RATE') or 0.2)
+
+# Параметры отправки рассылок
+NEWSLETTER_BATCH_SIZE = int(os.getenv('NEWSLETTER_BATCH_SIZE') or 100)  # Количество писем в одной пачке отправки
+NEWSLETTER_RECIPIENT_CHUNK_SIZE = int(os.getenv('NEWSLETTER_RECIPIENT_CHUNK_SIZE') or 2000)  # Адресов за одно чтение из БД
+NEWSLETTER_SMTP_POOL_SIZE = int(os.getenv('NEWSLETTER_SMTP_POOL_SIZE') or 8)  # Максимум одновременных SMTP-соединений, до него растет окно регулятора
+NEWSLETTER_TARGET_LATENCY = float(os.getenv('NEWSLETTER_TARGET_LATENCY') or 1)  # Приемлемое время отправки письма, с
+NEWSLETTER_WORKERS = int(os.getenv('NEWSLETTER_WORKERS') or 8)  # Количество потоков параллельной отправки, не меньше NEWSLETTER_SMTP_POOL_SIZE
+NEWSLETTER_CLAIM_LIMIT = int(os.getenv('NEWSLETTER_CLAIM_LIMIT') or 10)  # Количество задач отправки, захватываемых процессом за раз
+NEWSLETTER_LEASE_SECONDS = int(os.getenv('NEWSLETTER_LEASE_SECONDS') or 15)  # Время аренды захваченной задачи отправки
+NEWSLETTER_RESERVE_SIZE = int(os.getenv('NEWSLETTER_RESERVE_SIZE') or 10)  # Писем между записями прогресса отправки
+NEWSLETTER_PREPARED_CACHE_SIZE = 128  # Количество подготовленных к отправке писем, хранимых в памяти процесса
+NEWSLETTER_RETRY_MAX_ATTEMPTS = int(os.getenv('NEWSLETTER_RETRY_MAX_ATTEMPTS') or 5)  # Попыток отправки при временных ошибках
+NEWSLETTER_RETRY_BASE_SECONDS = int(os.getenv('NEWSLETTER_RETRY_BASE_SECONDS') or 60)  # Задержка перед первым повтором
+NEWSLETTER_RETRY_MAX_SECONDS = int(os.getenv('NEWSLETTER_RETRY_MAX_SECONDS') or 3600)  # Максимальная задержка повтора
+NEWSLETTER_CATCHUP_BATCH = int(os.getenv('NEWSLETTER_CATCHUP_BATCH') or 100)  # Наступивших рассылок, захватываемых за один запрос
+NEWSLETTER_MAX_LAG = int(os.getenv('NEWSLETTER_MAX_LAG') or 0)  # Опоздавшая дольше (с) рассылка не отправляется, а переносится, 0 - без ограничения
+NEWSLETTER_SUPPRESSION_REBUILD_SECONDS = int(os.getenv('NEWSLETTER_SUPPRESSION_REBUILD_SECONDS') or 3600)  # Период перестроения фильтра исключенных адресов
+NEWSLETTER_SOFT_BOUNCE_LIMIT = int(os.getenv('NEWSLETTER_SOFT_BOUNCE_LIMIT') or 3)  # Временных отказов, после которых адрес исключается
+NEWSLETTER_UNSUBSCRIBE_LINKS = os.getenv('NEWSLETTER_UNSUBSCRIBE_LINKS') == 'True'  # Персональная ссылка отписки и заголовок List-Unsubscribe в письмах рассылок, требует SITE_URL
+NEWSLETTER_TRACKING = os.getenv('NEWSLETTER_TRACKING') == 'True'  # Учет открытий писем и переходов по ссылкам рассылок, требует SITE_URL
+NEWSLETTER_METRICS_TOKEN = os.getenv('NEWSLETTER_METRICS_TOKEN')  # Токен доступа к /metrics/ (Authorization: Bearer), без него - только персонал
+
+# События отправки рассылок пишутся в лог newsletter в формате logfmt (event=... ключ=значение)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'newsletter': {'handlers': ['console'], 'level': os.getenv('NEWSLETTER_LOG_LEVEL') or 'INFO'},
+    },
+}
+
 CACHE_ENABLED = True
 
 if CACHE_ENABLED:
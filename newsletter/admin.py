@@ -1,19 +1,20 @@
 from django.contrib import admin
 
-from newsletter.models import Newsletter, Client, Log, Message
+from newsletter.models import Newsletter, Client, Log, Message, Delivery, OutboxTask, Suppression, \
+    Engagement, DashboardCounter, TransactionalMail
 
 
 # Register your models here.
 @admin.register(Newsletter)
 class NewsletterAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'start_date', 'time', 'frequency', 'status')
+    list_display = ('id', 'name', 'start_date', 'time', 'next_run_at', 'frequency', 'status')
     list_filter = ('time', 'start_date', 'frequency', 'status',)
 
 
 @admin.register(Client)
 class ClientAdmin(admin.ModelAdmin):
-    list_display = ('id', 'fullname', 'email')
-    list_filter = ('fullname', )
+    list_display = ('id', 'fullname', 'email', 'deliverability', 'soft_bounces', 'last_bounce_at')
+    list_filter = ('fullname', 'deliverability')
 
 
 @admin.register(Message)
@@ -23,5 +24,42 @@ class MessageAdmin(admin.ModelAdmin):
 
 @admin.register(Log)
 class LogAdmin(admin.ModelAdmin):
-    list_display = ('id', 'datetime', 'status', 'server_response', 'newsletter')
+    list_display = ('id', 'datetime', 'status', 'total_count', 'sent_count', 'failed_count', 'suppressed_count',
+                    'duration', 'newsletter')
     list_filter = ('newsletter', 'status', 'datetime')
+
+
+@admin.register(Delivery)
+class DeliveryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'datetime', 'email', 'status', 'error', 'newsletter')
+    list_filter = ('status', 'newsletter')
+    search_fields = ('email',)
+
+
+@admin.register(OutboxTask)
+class OutboxTaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'newsletter', 'log', 'attempts', 'next_attempt_at', 'last_error')
+    list_filter = ('newsletter',)
+
+
+@admin.register(TransactionalMail)
+class TransactionalMailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'subject', 'attempts', 'next_attempt_at', 'last_error')
+
+
+@admin.register(Suppression)
+class SuppressionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'email', 'reason', 'created_at')
+    list_filter = ('reason',)
+    search_fields = ('email',)
+
+
+@admin.register(Engagement)
+class EngagementAdmin(admin.ModelAdmin):
+    list_display = ('id', 'newsletter', 'date', 'opens', 'clicks')
+    list_filter = ('newsletter', 'date')
+
+
+@admin.register(DashboardCounter)
+class DashboardCounterAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'value')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class NewsletterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'newsletter'
+
+    def ready(self):
+        import newsletter.checks  # noqa: F401
+        import newsletter.signals  # noqa: F401
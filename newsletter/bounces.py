@@ -0,0 +1,166 @@
+import os
+import re
+from collections import Counter
+from email import message_from_binary_file, message_from_bytes, policy
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Lower, Trim
+from django.utils import timezone
+
+from newsletter.metrics import log_event
+from newsletter.models import BounceCheckpoint, Client, ProcessedBounce, Suppression, normalize_email
+from newsletter.services import get_batches
+
+# Расширенный код статуса SMTP (RFC 3463) в тексте уведомления без отчета о доставке
+STATUS_RE = re.compile(r'\b([245]\.\d{1,3}\.\d{1,3})\b')
+
+
+def parse_bounce(message):
+    """Получатели из уведомления о недоставке: список (адрес, постоянный ли отказ, статус).
+
+    Уведомления в формате DSN (RFC 3464) разбираются по полям Action и Status отчета; отказ постоянный,
+    если доставка завершилась ошибкой с кодом 5.x.x. Для уведомлений без отчета используется заголовок
+    X-Failed-Recipients и первый код статуса в тексте.
+    """
+    bounces = []
+    for part in message.walk():
+        if part.get_content_type() != 'message/delivery-status':
+            continue
+        for fields in part.get_payload():
+            recipient = fields.get('Final-Recipient') or fields.get('Original-Recipient')
+            if not recipient:
+                continue
+            action = str(fields.get('Action', '')).strip().lower()
+            if action in ('delivered', 'relayed', 'expanded', 'delayed'):
+                # Отложенная доставка еще не отказ: сервер продолжает попытки и пришлет итоговое уведомление
+                continue
+            status = str(fields.get('Status', '')).strip()
+            address = str(recipient).split(';', 1)[-1].strip().strip('<>')
+            bounces.append((address, action == 'failed' and not status.startswith('4'), status or action))
+    if bounces or not message['X-Failed-Recipients']:
+        return bounces
+
+    body = message.get_body(preferencelist=('plain',))
+    match = STATUS_RE.search(body.get_content() if body else '')
+    status = match.group(1) if match else ''
+    return [(address.strip(), not status.startswith('4'), status)
+            for address in str(message['X-Failed-Recipients']).split(',') if address.strip()]
+
+
+def apply_bounces(bounces):
+    """Учет пачки отказов в доставляемости клиентов и в списке исключений.
+
+    Клиенты с постоянным отказом помечаются недоступными, временные отказы суммируются в soft_bounces.
+    Адреса с постоянным отказом и с NEWSLETTER_SOFT_BOUNCE_LIMIT временными отказами добавляются в Suppression,
+    поэтому следующие рассылки их пропускают. На всю пачку выполняется по одному UPDATE для постоянных
+    и временных отказов. Возвращает количество адресов с постоянным и временным отказом.
+    """
+    now = timezone.now()
+    statuses = {normalize_email(address): status[:100] for address, is_hard, status in bounces}
+    hard = {normalize_email(address) for address, is_hard, status in bounces if is_hard}
+    soft = Counter(normalize_email(address) for address, is_hard, status in bounces
+                   if not is_hard and normalize_email(address) not in hard)
+    clients = Client.objects.annotate(normalized_email=Lower(Trim('email')))
+
+    def for_each(emails, values):
+        return Case(*[When(normalized_email=email, then=Value(values[email])) for email in emails])
+
+    if hard:
+        clients.filter(normalized_email__in=hard).update(
+            deliverability=Client.Deliverability.HARD_BOUNCE, last_bounce_at=now,
+            last_bounce_status=for_each(hard, statuses))
+    if soft:
+        clients.filter(normalized_email__in=soft).update(
+            soft_bounces=F('soft_bounces') + for_each(soft, soft), last_bounce_at=now,
+            last_bounce_status=for_each(soft, statuses),
+            deliverability=Case(When(deliverability=Client.Deliverability.HARD_BOUNCE, then=F('deliverability')),
+                                default=Value(Client.Deliverability.SOFT_BOUNCE)))
+
+    worn_out = set(clients.filter(normalized_email__in=soft, soft_bounces__gte=settings.NEWSLETTER_SOFT_BOUNCE_LIMIT)
+                   .values_list('normalized_email', flat=True))
+    Suppression.objects.bulk_create([Suppression(email=email, reason=Suppression.Reason.BOUNCED)
+                                     for email in hard | worn_out], ignore_conflicts=True)
+    return len(hard), len(soft)
+
+
+def collect_bounces(messages):
+    """Отказы из пачки уведомлений; письма, которые не удалось разобрать, пропускаются"""
+    bounces = []
+    for message in messages:
+        try:
+            bounces += parse_bounce(message)
+        except Exception as error:
+            # Одно испорченное письмо не должно останавливать разбор всего ящика
+            log_event('bounce_unparsed', message_id=message.get('Message-ID'), error=repr(error))
+    return bounces
+
+
+def read_message(lines):
+    """Письмо mbox без строки-разделителя From_ и с восстановленными строками >From"""
+    return message_from_bytes(b''.join(line[1:] if line.startswith(b'>From ') else line for line in lines[1:]),
+                              policy=policy.default)
+
+
+def iter_mbox(path, position=0):
+    """Потоковое чтение mbox с байта position: пары (письмо, позиция в файле после него).
+
+    Последнее письмо возвращается, только если оно завершено пустой строкой: в файл может идти запись.
+    """
+    with open(path, 'rb') as file:
+        file.seek(position)
+        lines = []
+        for line in file:
+            if line.startswith(b'From ') and lines and not lines[-1].strip():
+                yield read_message(lines), position
+                lines = []
+            lines.append(line)
+            position += len(line)
+        if lines and not lines[-1].strip():
+            yield read_message(lines), position
+
+
+def process_mbox(path, batch_size):
+    """Обработка новых уведомлений mbox пачками; после каждой пачки в той же транзакции сохраняется позиция.
+
+    Если файл заменен (другой inode) или стал короче позиции, он читается с начала. Возвращает итератор
+    по пачкам: (писем, постоянных отказов, временных отказов).
+    """
+    stat = os.stat(path)
+    checkpoint, created = BounceCheckpoint.objects.get_or_create(path=os.path.abspath(path),
+                                                                 defaults={'inode': stat.st_ino})
+    if checkpoint.inode != stat.st_ino or checkpoint.position > stat.st_size:
+        checkpoint.inode, checkpoint.position = stat.st_ino, 0
+    for batch in get_batches(iter_mbox(path, checkpoint.position), batch_size):
+        with transaction.atomic():
+            hard, soft = apply_bounces(collect_bounces(message for message, position in batch))
+            checkpoint.position = batch[-1][1]
+            checkpoint.save()
+        yield len(batch), hard, soft
+
+
+def process_maildir(path, batch_size):
+    """Обработка новых уведомлений Maildir пачками.
+
+    Обработанные письма переносятся из new/ в cur/ с флагом S (прочитано), как это делают почтовые клиенты,
+    поэтому повторно не разбираются. Имена писем пачки записываются в ProcessedBounce в одной транзакции
+    с учетом отказов: если процесс упадет до переноса, письма будут перенесены без повторного учета.
+    Возвращает итератор по пачкам: (писем, постоянных отказов, временных отказов).
+    """
+    new = os.path.join(path, 'new')
+    names = sorted(os.listdir(new))
+    for batch in get_batches(names, batch_size):
+        processed = set(ProcessedBounce.objects.filter(key__in=batch).values_list('key', flat=True))
+        messages = []
+        for name in batch:
+            if name not in processed:
+                with open(os.path.join(new, name), 'rb') as file:
+                    messages.append(message_from_binary_file(file, policy=policy.default))
+        with transaction.atomic():
+            hard, soft = apply_bounces(collect_bounces(messages))
+            ProcessedBounce.objects.bulk_create([ProcessedBounce(key=name) for name in batch if name not in processed])
+        for name in batch:
+            os.rename(os.path.join(new, name), os.path.join(path, 'cur', f'{name}:2,S'))
+        ProcessedBounce.objects.filter(key__in=batch).delete()
+        yield len(messages), hard, soft
@@ -0,0 +1,106 @@
+import functools
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+CACHED_KEY_PREFIX = 'cached'
+
+
+class CacheLock:
+    """Блокировка в кеше, общая для всех процессов; timeout ограничивает ее срок, если владелец упадет"""
+
+    def __init__(self, name, timeout):
+        self.key = f'{name}:lock'
+        self.timeout = timeout
+
+    def acquire(self):
+        """Захват без ожидания; возвращает, захвачена ли блокировка"""
+        return cache.add(self.key, 1, timeout=self.timeout)
+
+    def release(self):
+        cache.delete(self.key)
+
+    def acquire_or_wait(self, current, load, timeout):
+        """Захват блокировки пересчета значения, которое хранится в кеше и читается функцией load.
+
+        Пока блокировку держит другой процесс, ждать имеет смысл, только если значения current нет: тогда load
+        повторяется, пока владелец его не сохранит, но не дольше timeout секунд. Возвращает (захвачена ли
+        блокировка, значение); (False, None) - значения нет, и его придется вычислить без блокировки.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.acquire():
+            if current is not None or time.monotonic() >= deadline:
+                return False, current
+            time.sleep(0.05)
+            current = load()
+        return True, current
+
+
+class CachedFunction:
+    """Функция, результат которой хранится в кеше и пересчитывается одним процессом, пока остальные получают
+    прежнее значение (stale-while-revalidate); invalidate() делает устаревшими все ее значения."""
+
+    def __init__(self, func, namespace, version, timeout, stale, lock_timeout):
+        self.func = func
+        self.namespace = namespace
+        self.version = version
+        self.timeout = timeout
+        self.stale = timeout if stale is None else stale
+        self.lock_timeout = lock_timeout
+        self.generation_key = f'{CACHED_KEY_PREFIX}:{namespace}:generation'
+        functools.update_wrapper(self, func)
+
+    def get_key(self, args):
+        return ':'.join([CACHED_KEY_PREFIX, self.namespace, f'v{self.version}', *map(str, args)])
+
+    def __call__(self, *args):
+        if not settings.CACHE_ENABLED:
+            return self.func(*args)
+        key = self.get_key(args)
+        values = cache.get_many([key, self.generation_key])
+        generation = values.get(self.generation_key, 0)
+        entry = values.get(key)
+        if entry is not None:
+            value, fresh_until, entry_generation = entry
+            if entry_generation == generation and time.time() < fresh_until:
+                return value
+
+        lock = CacheLock(key, self.lock_timeout)
+        acquired, entry = lock.acquire_or_wait(entry, lambda: cache.get(key), self.lock_timeout)
+        if not acquired:
+            # Значение пересчитывает другой процесс: отдается прежнее или только что сохраненное им
+            return self.func(*args) if entry is None else entry[0]
+        try:
+            value = self.func(*args)
+            cache.set(key, (value, time.time() + self.timeout, generation), timeout=self.timeout + self.stale)
+        finally:
+            lock.release()
+        return value
+
+    def invalidate(self, **kwargs):
+        """Перевод всех значений функции в устаревшие; подходит как обработчик сигнала"""
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            cache.add(self.generation_key, 0, timeout=None)
+            cache.incr(self.generation_key)
+
+
+def cached(namespace, version=1, timeout=300, stale=None, lock_timeout=10, invalidated_by=()):
+    """Декоратор кеширования результата функции по ее позиционным аргументам.
+
+    timeout - сколько секунд значение свежее, stale - сколько еще секунд после этого отдается устаревшее значение,
+    пока оно пересчитывается (по умолчанию столько же), lock_timeout - сколько ждать чужого пересчета, если значения
+    нет. Сохранение и удаление объектов моделей invalidated_by сбрасывают значения функции.
+    """
+    def decorator(func):
+        cached_function = CachedFunction(func, namespace, version, timeout, stale, lock_timeout)
+        for model in invalidated_by:
+            post_save.connect(cached_function.invalidate, sender=model, weak=False,
+                              dispatch_uid=f'{CACHED_KEY_PREFIX}:{namespace}:post_save')
+            post_delete.connect(cached_function.invalidate, sender=model, weak=False,
+                                dispatch_uid=f'{CACHED_KEY_PREFIX}:{namespace}:post_delete')
+        return cached_function
+    return decorator
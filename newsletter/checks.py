@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Настройки, при которых в письма добавляются ссылки на сайт
+SITE_URL_SETTINGS = ('NEWSLETTER_UNSUBSCRIBE_LINKS', 'NEWSLETTER_TRACKING')
+
+
+@register()
+def check_site_url(app_configs, **kwargs):
+    """Ссылки отписки и учета переходов строятся от SITE_URL: без него письма получили бы неработающие ссылки"""
+    if settings.SITE_URL:
+        return []
+    return [Error('Ссылки в письмах требуют адреса сайта', hint='Задайте SITE_URL, например https://example.com',
+                  obj=name, id='newsletter.E001')
+            for name in SITE_URL_SETTINGS if getattr(settings, name)]
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
+
+from newsletter.metrics import log_event
+from newsletter.models import Client, DashboardCounter, Newsletter
+from newsletter.services import get_batches
+
+# Показатели главной страницы
+DASHBOARD_COUNTERS = ('newsletters', 'active_newsletters', 'client_emails')
+
+
+def count_dashboard():
+    """Показатели главной страницы, подсчитанные по таблицам; уникальные адреса клиентов - полный просмотр таблицы"""
+    newsletters = Newsletter.objects.aggregate(newsletters=Count('pk'),
+                                               active_newsletters=Count('pk', filter=Q(is_active=True)))
+    return {**newsletters, 'client_emails': Client.objects.values('email').distinct().count()}
+
+
+def reconcile_dashboard_counters():
+    """Запись в счетчики точных значений показателей; возвращает расхождения {счетчик: точное - сохраненное}.
+
+    Исправляет изменения, которые прошли мимо сигналов (bulk_create, update), и гонки одновременных изменений.
+    """
+    actual = count_dashboard()
+    stored = dict(DashboardCounter.objects.values_list('name', 'value'))
+    DashboardCounter.objects.bulk_create([DashboardCounter(name=name, value=value) for name, value in actual.items()],
+                                         update_conflicts=True, unique_fields=['name'], update_fields=['value'])
+    drift = {name: value - stored.get(name, 0) for name, value in actual.items() if value != stored.get(name, 0)}
+    if drift:
+        log_event('dashboard_reconciled', **drift)
+    return drift
+
+
+def get_dashboard_counters():
+    """Показатели главной страницы из счетчиков, одним запросом без агрегации"""
+    counters = dict(DashboardCounter.objects.values_list('name', 'value'))
+    if len(counters) < len(DASHBOARD_COUNTERS):
+        # Счетчики еще не созданы
+        reconcile_dashboard_counters()
+        counters = dict(DashboardCounter.objects.values_list('name', 'value'))
+    return counters
+
+
+def change_dashboard_counters(**deltas):
+    """Изменение счетчиков на {счетчик: приращение} одним UPDATE"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if deltas:
+        DashboardCounter.objects.filter(name__in=deltas).update(
+            value=F('value') + Case(*[When(name=name, then=Value(delta)) for name, delta in deltas.items()]))
+
+
+def defer_to_commit(origin, name, item, callback):
+    """Сбор объектов одного удаления и передача их в callback одним списком после фиксации транзакции.
+
+    Сигнал post_delete приходит для каждого удаленного объекта, а origin у объектов одного удаления общий,
+    поэтому удаление тысяч объектов пересчитывает счетчики один раз.
+    """
+    items = getattr(origin, name, None)
+    if items is None:
+        items = []
+        setattr(origin, name, items)
+
+        def flush():
+            setattr(origin, name, None)
+            callback(items)
+
+        transaction.on_commit(flush)
+    items.append(item)
+
+
+def newsletters_deleted(active):
+    """Учет удаленных рассылок по списку их активности"""
+    change_dashboard_counters(newsletters=-len(active), active_newsletters=-sum(active))
+
+
+def client_added(email):
+    """Учет нового клиента или нового адреса клиента: адрес, которого не было, увеличивает число уникальных"""
+    if Client.objects.filter(email=email).count() == 1:
+        change_dashboard_counters(client_emails=1)
+
+
+def clients_removed(emails):
+    """Учет удаленных адресов клиентов: адреса, которых больше нет ни у одного клиента, уменьшают число уникальных"""
+    emails = set(emails)
+    remaining = 0
+    for batch in get_batches(emails, settings.NEWSLETTER_RECIPIENT_CHUNK_SIZE):
+        remaining += Client.objects.filter(email__in=batch).values('email').distinct().count()
+    change_dashboard_counters(client_emails=remaining - len(emails))
@@ -1,6 +1,8 @@
 from django import forms
+from django.template import TemplateSyntaxError
 
 from newsletter.models import Newsletter, Message, Client
+from newsletter.services import is_personalized, personalization_engine
 
 
 class StyleFormMixin:
@@ -33,9 +35,19 @@ class MessageForm(StyleFormMixin, forms.ModelForm):
         model = Message
         exclude = ('user',)
 
+    def clean_content(self):
+        """Проверка подстановок в тексте письма: шаблон с ошибкой не удалось бы отправить ни одному получателю"""
+        content = self.cleaned_data['content']
+        if content and is_personalized(content):
+            try:
+                personalization_engine.from_string(content)
+            except TemplateSyntaxError as error:
+                raise forms.ValidationError(f'Ошибка в подстановках текста письма: {error}')
+        return content
+
 
 class ClientForm(StyleFormMixin, forms.ModelForm):
     class Meta:
         model = Client
-        exclude = ('user',)
+        exclude = ('user', 'deliverability', 'soft_bounces', 'last_bounce_at', 'last_bounce_status')
 
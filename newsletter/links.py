@@ -0,0 +1,14 @@
+import functools
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import reverse
+
+
+@functools.cache
+def get_site_url_format(viewname):
+    """Шаблон ссылки на сайт с токеном {token} для писем; reverse() занимает больше времени, чем подпись,
+    поэтому выполняется один раз на view"""
+    if not settings.SITE_URL:
+        raise ImproperlyConfigured(f'Ссылки {viewname} в письмах требуют SITE_URL')
+    return settings.SITE_URL + reverse(viewname, args=['TOKEN']).replace('TOKEN', '{token}')
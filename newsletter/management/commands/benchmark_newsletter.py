@@ -0,0 +1,289 @@
+import contextlib
+import io
+import itertools
+import logging
+import multiprocessing
+import resource
+import statistics
+import time
+import tracemalloc
+from json import dumps
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail.backends import dummy
+from django.core.management import BaseCommand, call_command
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import Context
+from django.utils import timezone
+from django.test.utils import override_settings
+
+from newsletter.management.commands.fake_smtp import FakeSMTPServer
+from newsletter.management.commands.seed_newsletter import add_test_db_argument, check_test_db, cleanup, \
+    seed_newsletter
+from newsletter.models import Log, Newsletter
+from newsletter.services import PreparedEmailMessage, PreparedMessage, my_job, personalization_engine, \
+    schedule_due_newsletters, send_outbox
+from newsletter.suppression import BloomFilter
+
+DEFAULT_RECIPIENTS = {'shards': [4000], 'load': [1000, 5000], 'suppression': [100_000, 1_000_000]}
+
+
+class SlowEmailBackend(dummy.EmailBackend):
+    """Почтовый бэкенд без отправки, который имитирует задержку ответа SMTP-сервера на каждое письмо"""
+    latency = 0.01
+
+    def send_messages(self, email_messages):
+        time.sleep(self.latency * len(email_messages))
+        return super().send_messages(email_messages)
+
+
+def run_shard(shard):
+    """Отправка задач outbox одного шарда в отдельном процессе"""
+    with override_settings(EMAIL_BACKEND=f'{__name__}.SlowEmailBackend'):
+        send_outbox(shard=shard)
+    connections.close_all()
+
+
+def run_measured(results, overrides, function, *args, **kwargs):
+    """Вызов function в дочернем процессе с подсчетом запросов к БД из всех потоков и пикового RSS"""
+    queries = itertools.count()
+
+    def count_query(execute, sql, params, many, context):
+        next(queries)
+        return execute(sql, params, many, context)
+
+    connection_created.connect(lambda connection, **signal_kwargs: connection.execute_wrappers.append(count_query),
+                               weak=False)
+    with override_settings(**overrides), contextlib.redirect_stdout(io.StringIO()):
+        function(*args, **kwargs)
+    connections.close_all()
+    results.put((next(queries), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def run_processes(calls, overrides):
+    """Параллельный запуск вызовов (функция, аргументы) в дочерних процессах.
+
+    Возвращает общее количество запросов к БД и наибольший пиковый RSS процесса, МБ.
+    """
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    connections.close_all()
+    processes = [context.Process(target=run_measured, args=[results, overrides, function, *args])
+                 for function, *args in calls]
+    for process in processes:
+        process.start()
+    measured = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return sum(queries for queries, rss in measured), max(rss for queries, rss in measured)
+
+
+def send_once(shard):
+    """Один проход run_newsletter --once для шарда"""
+    call_command('run_newsletter', once=True, shard=shard)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks of the newsletter dispatch pipeline. Creates and removes its own data, ' \
+           'do not run against the production database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('case', choices=['memory', 'mime', 'render', 'shards', 'load', 'suppression'])
+        parser.add_argument('--recipients', type=int, nargs='+',
+                            help='Audience sizes to measure (default: 10000 50000 100000, 4000 per newsletter '
+                                 'for the shards case, 1000 5000 for the load case, suppressed addresses '
+                                 'for the suppression case)')
+        parser.add_argument('--body-size', type=int, default=5_000, help='Message body length for the mime case')
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4],
+                            help='Numbers of worker processes for the shards case (PostgreSQL only)')
+        parser.add_argument('--newsletters', type=int, default=1, help='Newsletters sent in the shards case')
+        parser.add_argument('--latency', type=float, default=0.01,
+                            help='Simulated SMTP reply time per message in the shards and load cases, seconds')
+        parser.add_argument('--defer-rate', type=float, default=0.0,
+                            help='Share of recipients the fake SMTP server defers with 451 in the load case')
+        parser.add_argument('--fail-rate', type=float, default=0.0,
+                            help='Share of recipients the fake SMTP server refuses with 550 in the load case')
+        parser.add_argument('--senders', type=int, default=1,
+                            help='Parallel run_newsletter --once processes in the load case')
+        parser.add_argument('--json', metavar='FILE',
+                            help='Append load case results to FILE as JSON lines, to compare releases')
+        add_test_db_argument(parser)
+
+    def handle(self, *args, **options):
+        check_test_db(options)
+        # События отправки не смешиваются с результатами замеров
+        logging.getLogger('newsletter').setLevel(logging.WARNING)
+        options['recipients'] = options['recipients'] or DEFAULT_RECIPIENTS.get(options['case'],
+                                                                                [10_000, 50_000, 100_000])
+        getattr(self, f'bench_{options["case"]}')(**options)
+
+    def bench_memory(self, recipients, **options):
+        """Пиковый расход памяти при отправке в зависимости от количества получателей"""
+        self.stdout.write(f'{"recipients":>10} {"list of Client, MB":>18} {"dispatch peak, MB":>18} {"time, s":>8}')
+        for count in recipients:
+            cleanup()
+            newsletter = seed_newsletter(count)
+            try:
+                tracemalloc.start()
+                recipient_list = [client.email for client in newsletter.clients.all()]
+                materialized_peak = tracemalloc.get_traced_memory()[1]
+                del recipient_list
+                tracemalloc.reset_peak()
+
+                started = time.perf_counter()
+                with override_settings(EMAIL_BACKEND='django.core.mail.backends.dummy.EmailBackend'):
+                    schedule_due_newsletters(timezone.now(), [newsletter.pk])
+                    send_outbox()
+                elapsed = time.perf_counter() - started
+                dispatch_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            finally:
+                cleanup()
+            self.stdout.write(f'{count:>10} {materialized_peak / 2 ** 20:>18.1f} '
+                              f'{dispatch_peak / 2 ** 20:>18.1f} {elapsed:>8.1f}')
+
+    def bench_mime(self, recipients, body_size, **options):
+        """Время подготовки письма к отправке: сборка MIME для каждого получателя и подготовленное письмо"""
+        subject = 'Еженедельная рассылка'
+        content = ('Текст рассылки с кириллицей и длинными строками. ' * (body_size // 50 + 1))[:body_size]
+        self.stdout.write(f'{"recipients":>10} {"EmailMessage, us":>17} {"PreparedMessage, us":>20} {"speedup":>8}')
+        for count in recipients:
+            started = time.perf_counter()
+            for i in range(count):
+                EmailMessage(subject, content, settings.EMAIL_HOST_USER,
+                             [f'client{i}@example.com']).message().as_bytes(linesep='\r\n')
+            plain = (time.perf_counter() - started) / count
+
+            started = time.perf_counter()
+            prepared = PreparedMessage(subject, content, settings.EMAIL_HOST_USER)
+            for i in range(count):
+                PreparedEmailMessage(prepared, f'client{i}@example.com').message().as_bytes(linesep='\r\n')
+            reused = (time.perf_counter() - started) / count
+            self.stdout.write(f'{count:>10} {plain * 1e6:>17.1f} {reused * 1e6:>20.1f} {plain / reused:>7.1f}x')
+
+    def bench_render(self, recipients, body_size, **options):
+        """Время подстановки имени получателя: компиляция шаблона для каждого письма и скомпилированный шаблон"""
+        subject = 'Еженедельная рассылка'
+        content = 'Здравствуйте, {{ fullname }}!\n' + ('Текст рассылки с кириллицей.\n' * (body_size // 30 + 1))[:body_size]
+        self.stdout.write(f'{"recipients":>10} {"compile each, us":>17} {"compiled once, us":>18} {"speedup":>8}')
+        for count in recipients:
+            started = time.perf_counter()
+            for i in range(count):
+                body = personalization_engine.from_string(content).render(Context({'fullname': f'Client {i}'}))
+                EmailMessage(subject, body, settings.EMAIL_HOST_USER,
+                             [f'client{i}@example.com']).message().as_bytes(linesep='\r\n')
+            plain = (time.perf_counter() - started) / count
+
+            started = time.perf_counter()
+            prepared = PreparedMessage(subject, content, settings.EMAIL_HOST_USER)
+            for i in range(count):
+                PreparedEmailMessage(prepared, f'client{i}@example.com',
+                                     f'Client {i}').message().as_bytes(linesep='\r\n')
+            reused = (time.perf_counter() - started) / count
+            self.stdout.write(f'{count:>10} {plain * 1e6:>17.1f} {reused * 1e6:>18.1f} {plain / reused:>7.1f}x')
+
+    def bench_suppression(self, recipients, **options):
+        """Размер фильтра исключенных адресов, время его построения и проверки одного адреса"""
+        self.stdout.write(f'{"addresses":>10} {"filter, MB":>11} {"build, s":>9} {"lookup, us":>11} '
+                          f'{"false positives":>16}')
+        for count in recipients:
+            started = time.perf_counter()
+            bloom = BloomFilter(count)
+            for i in range(count):
+                bloom.add(f'suppressed{i}@example.com')
+            build = time.perf_counter() - started
+
+            started = time.perf_counter()
+            false_positives = sum(f'client{i}@example.com' in bloom for i in range(count))
+            lookup = (time.perf_counter() - started) / count
+            self.stdout.write(f'{count:>10} {len(bloom.bits) / 2 ** 20:>11.1f} {build:>9.1f} {lookup * 1e6:>11.2f} '
+                              f'{false_positives / count:>15.3%}')
+
+    def bench_shards(self, recipients, shards, newsletters, latency, **options):
+        """Время отправки одних и тех же рассылок процессами run_newsletter --shard"""
+        SlowEmailBackend.latency = latency
+        cleanup()
+        seeded = [seed_newsletter(recipients[0]) for _ in range(newsletters)]
+        messages = recipients[0] * newsletters
+        self.stdout.write(f'{"shards":>6} {"time, s":>8} {"messages/s":>11} {"speedup":>8}')
+        context = multiprocessing.get_context('fork')
+        baseline = None
+        try:
+            for count in shards:
+                Newsletter.objects.filter(pk__in=[newsletter.pk for newsletter in seeded]).update(
+                    status=Newsletter.Status.CREATED, next_run_at=timezone.now())
+                schedule_due_newsletters(timezone.now(), [newsletter.pk for newsletter in seeded])
+                connections.close_all()
+                started = time.perf_counter()
+                processes = [context.Process(target=run_shard, args=[(index, count)]) for index in range(count)]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+                elapsed = time.perf_counter() - started
+                baseline = baseline or elapsed * count  # Время одного процесса при линейном масштабировании
+                self.stdout.write(f'{count:>6} {elapsed:>8.1f} {messages / elapsed:>11.0f} {baseline / elapsed:>7.1f}x')
+        finally:
+            cleanup()
+
+    def bench_load(self, recipients, latency, defer_rate, fail_rate, senders, json, **options):
+        """Нагрузочный прогон my_job и run_newsletter --once через локальный SMTP-сервер"""
+        server = FakeSMTPServer(latency=latency, defer_rate=defer_rate, fail_rate=fail_rate, seed=0).start()
+        overrides = {
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': server.host,
+            'EMAIL_PORT': server.port,
+            'EMAIL_USE_SSL': False,
+            'EMAIL_USE_TLS': False,
+            'EMAIL_HOST_PASSWORD': '',
+            'EMAIL_RATE_LIMITS': {},
+            'NEWSLETTER_RETRY_BASE_SECONDS': 0,  # Отложенные письма повторяются в том же прогоне
+        }
+        self.stdout.write(f'{"recipients":>10} {"sent":>7} {"failed":>7} {"time, s":>8} {"messages/s":>11} '
+                          f'{"p50, ms":>8} {"p99, ms":>8} {"queries":>8} {"per msg":>8} {"peak RSS, MB":>13}')
+        try:
+            for count in recipients:
+                cleanup()
+                newsletter = seed_newsletter(count)
+                server.reset_stats()
+                started = time.perf_counter()
+                schedule_queries, schedule_rss = run_processes([(my_job,)], overrides)
+                send_queries, send_rss = run_processes(
+                    [(send_once, (index, senders) if senders > 1 else None) for index in range(senders)], overrides)
+                elapsed = time.perf_counter() - started
+
+                log = Log.objects.get(newsletter=newsletter)
+                quantiles = statistics.quantiles(server.latencies, n=100) if len(server.latencies) > 1 else [0] * 99
+                result = {
+                    'recipients': count,
+                    'sent': log.sent_count,
+                    'failed': log.failed_count,
+                    'seconds': round(elapsed, 3),
+                    'messages_per_second': round(log.sent_count / elapsed, 1),
+                    'p50_ms': round(quantiles[49] * 1000, 2),
+                    'p99_ms': round(quantiles[98] * 1000, 2),
+                    'queries': schedule_queries + send_queries,
+                    'peak_rss_mb': round(max(schedule_rss, send_rss), 1),
+                }
+                self.stdout.write(f'{count:>10} {result["sent"]:>7} {result["failed"]:>7} {elapsed:>8.1f} '
+                                  f'{result["messages_per_second"]:>11.0f} {result["p50_ms"]:>8.1f} '
+                                  f'{result["p99_ms"]:>8.1f} {result["queries"]:>8} '
+                                  f'{result["queries"] / count:>8.2f} {result["peak_rss_mb"]:>13.1f}')
+                if json:
+                    with open(json, 'a') as output:
+                        output.write(dumps({
+                            'case': 'load',
+                            'datetime': timezone.now().isoformat(),
+                            'latency': latency,
+                            'defer_rate': defer_rate,
+                            'fail_rate': fail_rate,
+                            'senders': senders,
+                            'workers': settings.NEWSLETTER_WORKERS,
+                            'pool_size': settings.NEWSLETTER_SMTP_POOL_SIZE,
+                            **result,
+                        }) + '\n')
+        finally:
+            server.stop()
+            cleanup()
@@ -0,0 +1,139 @@
+import asyncio
+import random
+import threading
+import time
+
+from django.core.management import BaseCommand
+
+
+class FakeSMTPServer:
+    """SMTP-сервер для нагрузочных замеров: принимает письма и никуда их не отправляет.
+
+    Ответ на каждое письмо задерживается на latency секунд, доля получателей defer_rate получает временный
+    отказ 451, доля fail_rate - постоянный 550. Сервер работает в отдельном потоке со своим циклом asyncio
+    и собирает статистику: количество принятых и отклоненных писем и время SMTP-транзакции каждого письма
+    от команды MAIL до ответа на DATA.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, defer_rate=0.0, fail_rate=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.defer_rate = defer_rate
+        self.fail_rate = fail_rate
+        self._random = random.Random(seed)
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.accepted = 0
+        self.deferred = 0
+        self.failed = 0
+        self.latencies = []
+
+    def start(self):
+        """Запуск сервера в фоновом потоке; порт 0 заменяется выбранным системой"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def get_reply(self, address):
+        """Ответ на RCPT TO для получателя"""
+        chance = self._random.random()
+        if chance < self.fail_rate:
+            self.failed += 1
+            return b'550 5.1.1 Mailbox unavailable'
+        if chance < self.fail_rate + self.defer_rate:
+            self.deferred += 1
+            return b'451 4.7.1 Try again later'
+        return b'250 2.1.5 OK'
+
+    async def handle(self, reader, writer):
+        """Обработка одной SMTP-сессии"""
+        def reply(line):
+            writer.write(line + b'\r\n')
+
+        reply(b'220 localhost ESMTP fake')
+        started = None
+        accepted_recipients = 0
+        try:
+            while line := await reader.readline():
+                command = line[:4].upper()
+                if command == b'EHLO':
+                    reply(b'250-localhost\r\n250-8BITMIME\r\n250 SMTPUTF8')
+                elif command in (b'HELO', b'NOOP'):
+                    reply(b'250 OK')
+                elif command == b'MAIL':
+                    started = time.monotonic()
+                    accepted_recipients = 0
+                    reply(b'250 2.1.0 OK')
+                elif command == b'RCPT':
+                    response = self.get_reply(line[8:].strip())
+                    accepted_recipients += response.startswith(b'250')
+                    reply(response)
+                elif command == b'RSET':
+                    started = None
+                    reply(b'250 2.0.0 OK')
+                elif command == b'DATA':
+                    reply(b'354 End data with <CR><LF>.<CR><LF>')
+                    await writer.drain()
+                    while await reader.readline() not in (b'.\r\n', b''):
+                        pass
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.accepted += accepted_recipients
+                    if started is not None:
+                        self.latencies.append(time.monotonic() - started)
+                    reply(b'250 2.0.0 Queued')
+                elif command == b'QUIT':
+                    reply(b'221 2.0.0 Bye')
+                    break
+                else:
+                    reply(b'502 5.5.2 Command not recognized')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class Command(BaseCommand):
+    help = 'Runs a local SMTP server that accepts mail without delivering it, for load tests. ' \
+           'Point EMAIL_HOST/EMAIL_PORT at it with EMAIL_USE_SSL=False.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--latency', type=float, default=0.0, help='Delay before accepting each message, seconds')
+        parser.add_argument('--defer-rate', type=float, default=0.0, help='Share of recipients refused with 451')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of recipients refused with 550')
+
+    def handle(self, *args, **options):
+        server = FakeSMTPServer(options['host'], options['port'], options['latency'], options['defer_rate'],
+                                options['fail_rate']).start()
+        self.stdout.write(f'Fake SMTP server listening on {server.host}:{server.port}')
+        try:
+            while True:
+                time.sleep(10)
+                self.stdout.write(f'accepted: {server.accepted}, deferred: {server.deferred}, failed: {server.failed}')
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from newsletter.metrics import get_queue_depth
+from newsletter.services import get_due_newsletters, get_next_start_date, schedule_due_newsletters
+
+
+class Command(BaseCommand):
+    help = 'Shows newsletters that are due but not yet put into the outbox (for example after an outage) and ' \
+           'the outbox depth. With --skip-older-than, newsletters later than that are not sent and move to ' \
+           'their next date.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-older-than', type=int, metavar='SECONDS',
+                            help='Skip overdue newsletters that are later than SECONDS instead of sending them')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        overdue = list(get_due_newsletters(now).annotate(recipients=Count('clients')))
+        self.stdout.write(f'{"id":>6} {"name":<30} {"planned run":<17} {"late by":>16} {"missed runs":>11} '
+                          f'{"recipients":>10}')
+        for newsletter in overdue:
+            lag = datetime.timedelta(seconds=int((now - newsletter.next_run_at).total_seconds()))
+            missed_runs = get_next_start_date(newsletter, now)[1]
+            self.stdout.write(f'{newsletter.pk:>6} {(newsletter.name or "")[:30]:<30} '
+                              f'{timezone.localtime(newsletter.next_run_at):%Y-%m-%d %H:%M} {str(lag):>16} '
+                              f'{missed_runs:>11} {newsletter.recipients:>10}')
+        depth = get_queue_depth()
+        self.stdout.write(f'Overdue newsletters: {len(overdue)}. Outbox tasks: {depth["total"]}, due: {depth["due"]}, '
+                          f'retrying: {depth["retrying"]}, oldest due waits {depth["oldest_due_age"]:.0f} s')
+
+        skip_older_than = options['skip_older_than']
+        if skip_older_than is not None:
+            newsletter_ids = [newsletter.pk for newsletter in overdue
+                              if (now - newsletter.next_run_at).total_seconds() > skip_older_than]
+            # Все выбранные рассылки опоздали больше чем на max_lag, поэтому только переносятся на следующую дату
+            scheduled = schedule_due_newsletters(now, newsletter_ids, max_lag=skip_older_than)
+            self.stdout.write(f'Skipped newsletters: {len(newsletter_ids) - len(scheduled)}')
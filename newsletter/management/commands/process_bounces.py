@@ -0,0 +1,32 @@
+import os
+
+from django.core.management import BaseCommand, CommandError
+
+from newsletter.bounces import process_maildir, process_mbox
+
+
+class Command(BaseCommand):
+    help = 'Reads new delivery status notifications (bounces) from a Maildir or mbox, marks clients with hard ' \
+           'or repeated soft bounces as undeliverable and adds them to the suppression list. Processed mail ' \
+           'is remembered, so the command can run as often as needed, for example from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Maildir directory or mbox file with bounce messages')
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages per database transaction')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if os.path.isdir(os.path.join(path, 'new')):
+            batches = process_maildir(path, options['batch_size'])
+        elif os.path.isfile(path):
+            batches = process_mbox(path, options['batch_size'])
+        else:
+            raise CommandError(f'{path} is neither a Maildir nor an mbox file')
+        messages = hard = soft = 0
+        for batch_messages, batch_hard, batch_soft in batches:
+            messages += batch_messages
+            hard += batch_hard
+            soft += batch_soft
+            self.stdout.write(f'Processed {messages} messages: {hard} hard bounces, {soft} soft bounces')
+        if not messages:
+            self.stdout.write('No new bounce messages')
@@ -1,13 +1,30 @@
+import select
+import threading
+import time
+
 from django.conf import settings
 
+from apscheduler.events import EVENT_SCHEDULER_START
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from django.core.management.base import BaseCommand
+from django.db import connection
 from django_apscheduler.jobstores import DjangoJobStore
 from django_apscheduler.models import DjangoJobExecution
 from django_apscheduler import util
 
-from newsletter.services import my_job
+from newsletter.dashboard import reconcile_dashboard_counters
+from newsletter.metrics import log_event
+from newsletter.services import NEWSLETTER_SCHEDULE_CHANNEL, get_scheduled_newsletters, my_job, newsletter_job, \
+    send_transactional_outbox
+from newsletter.suppression import flush_unsubscribes
+from newsletter.tracking import flush_tracking
+
+# Триггеры рассылок вычисляются из расписания в БД при запуске, поэтому хранятся только в памяти процесса
+NEWSLETTER_JOBSTORE = "newsletters"
 
 
 # The `close_old_connections` decorator ensures that database connections, that have become
@@ -26,31 +43,182 @@ def delete_old_job_executions(max_age=604_800):
     DjangoJobExecution.objects.delete_old_job_executions(max_age)
 
 
-class Command(BaseCommand):
-    help = "Runs APScheduler."
+@util.close_old_connections
+def flush_unsubscribes_job():
+    """
+    Moves unsubscribes queued in the cache by the unsubscribe view into the suppression list.
+    """
+    flush_unsubscribes()
+
+
+@util.close_old_connections
+def reconcile_dashboard_counters_job():
+    """
+    Recounts the homepage figures, fixing changes made without model signals (bulk operations, raw updates).
+    """
+    reconcile_dashboard_counters()
+
+
+@util.close_old_connections
+def flush_tracking_job():
+    """
+    Adds opens and clicks buffered in the cache by the tracking views to the per-newsletter counters.
+    """
+    flush_tracking()
+
+
+@util.close_old_connections
+def send_transactional_outbox_job():
+    """
+    Sends registration and password reset emails deferred while the account rate limit was exhausted.
+    """
+    send_transactional_outbox()
 
-    def handle(self, *args, **options):
-        scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
-        scheduler.add_jobstore(DjangoJobStore(), "default")
 
+def schedule_newsletters(scheduler, scheduled, newsletter_ids):
+    """
+    Replaces the triggers of the given newsletters with a single run at their `next_run_at`.
+    Newsletters missing from `scheduled` (inactive, running or deleted) lose their trigger.
+    """
+    for newsletter_id in newsletter_ids:
+        job_id = f"newsletter_{newsletter_id}"
+        run_at = scheduled.get(newsletter_id)
+        if run_at is None:
+            if scheduler.get_job(job_id, NEWSLETTER_JOBSTORE):
+                scheduler.remove_job(job_id, NEWSLETTER_JOBSTORE)
+            continue
         scheduler.add_job(
-            my_job,
-            trigger=CronTrigger(minute="*/1"),  # Every 1 minute
-            id="my_job",  # The `id` assigned to each job MUST be unique
-            max_instances=1,
+            newsletter_job,
+            trigger=DateTrigger(run_date=run_at),
+            args=[newsletter_id],
+            id=job_id,
+            jobstore=NEWSLETTER_JOBSTORE,
+            misfire_grace_time=None,  # Overdue newsletters are sent as soon as possible
             replace_existing=True,
         )
 
-        scheduler.add_job(
-            delete_old_job_executions,
-            trigger=CronTrigger(
-                day_of_week="mon", hour="00", minute="00"
-            ),  # Midnight on Monday, before start of the next work week.
-            id="delete_old_job_executions",
-            max_instances=1,
-            replace_existing=True,
+
+def sync_newsletter_jobs(scheduler):
+    """
+    Rebuilds the triggers of all newsletters from the database.
+    """
+    scheduled = get_scheduled_newsletters()
+    stale_ids = {job.args[0] for job in scheduler.get_jobs(NEWSLETTER_JOBSTORE)} - scheduled.keys()
+    schedule_newsletters(scheduler, scheduled, [*scheduled, *stale_ids])
+
+
+def listen_schedule_changes(scheduler, timeout=60):
+    """
+    Keeps newsletter triggers in sync with the database. Waits for PostgreSQL notifications sent by the
+    `post_save`/`post_delete` signals of Newsletter, so no queries are made while nothing changes.
+    After (re)connecting all triggers are rebuilt, because notifications are not delivered while not listening.
+    """
+    while True:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NEWSLETTER_SCHEDULE_CHANNEL}")
+            sync_newsletter_jobs(scheduler)
+            listener = connection.connection
+            while True:
+                if not listener.notifies:
+                    select.select([listener], [], [], timeout)
+                    listener.poll()
+                newsletter_ids = {int(notify.payload) for notify in listener.notifies}
+                listener.notifies.clear()
+                if newsletter_ids:
+                    schedule_newsletters(scheduler, get_scheduled_newsletters(newsletter_ids), newsletter_ids)
+        except Exception as error:
+            log_event("schedule_listener_failed", error=repr(error))
+            connection.close()
+            time.sleep(5)
+
+
+class Command(BaseCommand):
+    help = "Runs APScheduler."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--worker",
+            action="store_true",
+            help="Run as an additional worker: only schedule newsletters, keep jobs in memory instead of the "
+                 "shared DjangoJobStore. Start any number of workers next to the main scheduler.",
+        )
+        parser.add_argument(
+            "--poll",
+            action="store_true",
+            help="Look for due newsletters every minute instead of keeping a trigger per newsletter. "
+                 "Used automatically when the database is not PostgreSQL.",
         )
 
+    def on_start(self, scheduler, poll):
+        # Jobs of the other mode or of older versions may be left in the DjangoJobStore by a previous run
+        for stale_job_id in ["release_stale_job", "retry_job"] + ([] if poll else ["my_job"]):
+            if scheduler.get_job(stale_job_id):
+                scheduler.remove_job(stale_job_id)
+        if not poll:
+            threading.Thread(target=listen_schedule_changes, args=[scheduler], daemon=True).start()
+
+    def handle(self, *args, **options):
+        scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
+        if not options["worker"]:
+            # APScheduler does not support sharing one job store between several schedulers,
+            # so only the main process keeps its jobs in the database.
+            scheduler.add_jobstore(DjangoJobStore(), "default")
+
+        poll = options["poll"] or connection.vendor != "postgresql"
+        scheduler.add_listener(lambda event: self.on_start(scheduler, poll), EVENT_SCHEDULER_START)
+        if poll:
+            scheduler.add_job(
+                my_job,
+                trigger=CronTrigger(minute="*/1"),  # Every 1 minute
+                id="my_job",  # The `id` assigned to each job MUST be unique
+                max_instances=1,
+                replace_existing=True,
+            )
+        else:
+            # Every newsletter gets its own trigger at `next_run_at`, kept in sync by a listener thread
+            # started together with the scheduler.
+            scheduler.add_jobstore(MemoryJobStore(), NEWSLETTER_JOBSTORE)
+
+        if not options["worker"]:
+            scheduler.add_job(
+                delete_old_job_executions,
+                trigger=CronTrigger(
+                    day_of_week="mon", hour="00", minute="00"
+                ),  # Midnight on Monday, before start of the next work week.
+                id="delete_old_job_executions",
+                max_instances=1,
+                replace_existing=True,
+            )
+            scheduler.add_job(
+                flush_unsubscribes_job,
+                trigger=IntervalTrigger(seconds=10),
+                id="flush_unsubscribes",
+                max_instances=1,
+                replace_existing=True,
+            )
+            scheduler.add_job(
+                flush_tracking_job,
+                trigger=IntervalTrigger(seconds=10),
+                id="flush_tracking",
+                max_instances=1,
+                replace_existing=True,
+            )
+            scheduler.add_job(
+                send_transactional_outbox_job,
+                trigger=IntervalTrigger(seconds=10),
+                id="send_transactional_outbox",
+                max_instances=1,
+                replace_existing=True,
+            )
+            scheduler.add_job(
+                reconcile_dashboard_counters_job,
+                trigger=IntervalTrigger(minutes=10),
+                id="reconcile_dashboard_counters",
+                max_instances=1,
+                replace_existing=True,
+            )
+
         try:
             scheduler.start()
         except KeyboardInterrupt:
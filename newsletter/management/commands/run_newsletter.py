@@ -1,10 +1,46 @@
+import argparse
+import signal
+
 from django.core.management import BaseCommand
+from django_apscheduler import util
+
+from newsletter.services import my_job, send_outbox, wait_for_outbox
 
-from newsletter.services import my_job
+
+def parse_shard(value):
+    """Разбор шарда обработчика в виде N/M, где N - номер от 0, M - количество шардов"""
+    try:
+        index, count = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('shard must look like N/M, for example 0/4')
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError('shard number must be from 0 to M - 1')
+    return index, count
 
 
 class Command(BaseCommand):
     help = "Run Newsletter"
 
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', type=parse_shard,
+                            help='Send only outbox tasks with id %% M == N, given as N/M. Start one sender per '
+                                 'shard on any cores and hosts, they need no coordinator besides the database.')
+        parser.add_argument('--interval', type=int, default=60,
+                            help='Longest wait for new outbox tasks, seconds (default: 60)')
+        parser.add_argument('--once', action='store_true',
+                            help='Put due newsletters into the outbox, send everything in it once and exit')
+
     def handle(self, *args, **options):
-        my_job()
+        # Остановка по SIGTERM как по Ctrl+C: невыполненные задачи сразу возвращаются в outbox
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        if options['once']:
+            util.close_old_connections(my_job)()
+            send_outbox(shard=options['shard'])
+            return
+        try:
+            while True:
+                # Пока в outbox находятся задачи, следующие захватываются сразу
+                if not send_outbox(shard=options['shard']):
+                    util.close_old_connections(wait_for_outbox)(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,82 @@
+import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from newsletter.dashboard import reconcile_dashboard_counters
+from newsletter.models import Client, Message, Newsletter
+from newsletter.services import get_batches
+
+BENCHMARK_MARK = 'benchmark'
+# Владелец данных бенчмарка: адрес в зоне .invalid нельзя подтвердить при регистрации, а пароля у него нет
+SEED_USER_EMAIL = 'newsletter-seed@benchmark.invalid'
+TEST_DB_FLAG = '--yes-this-is-a-test-db'
+
+
+def add_test_db_argument(parser):
+    parser.add_argument(TEST_DB_FLAG, action='store_true', dest='test_db',
+                        help='Allow creating and deleting benchmark data with DEBUG off')
+
+
+def check_test_db(options):
+    """Отказ от запуска на рабочей БД: команды создают и удаляют данные"""
+    if not settings.DEBUG and not options['test_db']:
+        raise CommandError(f'This command creates and deletes data. Run it with DEBUG on or pass {TEST_DB_FLAG}.')
+
+
+def get_seed_user():
+    """Пользователь, которому принадлежат данные бенчмарка; по нему cleanup() отличает их от данных пользователей"""
+    user, created = get_user_model().objects.get_or_create(email=SEED_USER_EMAIL, defaults={'is_active': False})
+    if created:
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    elif user.has_usable_password():
+        raise CommandError(f'{SEED_USER_EMAIL} is a registered account, benchmark data cannot be told apart')
+    return user
+
+
+def seed_newsletter(recipients):
+    """Создание рассылки с заданным количеством получателей"""
+    user = get_seed_user()
+    message = Message.objects.create(subject='Benchmark', content='Benchmark message', user=user)
+    newsletter = Newsletter.objects.create(name=BENCHMARK_MARK, start_date=datetime.date.today(), time=datetime.time(),
+                                           message=message, user=user)
+    Through = Newsletter.clients.through
+    for batch in get_batches(range(recipients), 5000):
+        clients = Client.objects.bulk_create([
+            Client(email=f'client{i}@example.com', fullname=f'Client {i}', comment=BENCHMARK_MARK, user=user)
+            for i in batch
+        ])
+        Through.objects.bulk_create([Through(newsletter=newsletter, client=client) for client in clients])
+    # bulk_create не вызывает сигналов, которые ведут счетчики главной страницы
+    reconcile_dashboard_counters()
+    return newsletter
+
+
+def cleanup():
+    """Удаление данных, созданных бенчмарком: только принадлежащих его пользователю"""
+    user = get_seed_user()
+    Newsletter.objects.filter(user=user).delete()
+    Message.objects.filter(user=user).delete()
+    Client.objects.filter(user=user).delete()
+
+
+class Command(BaseCommand):
+    help = 'Creates newsletters due right now with generated clients for load tests, or removes them. ' \
+           'Do not run against the production database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=10_000, help='Clients per newsletter')
+        parser.add_argument('--newsletters', type=int, default=1, help='Newsletters to create')
+        parser.add_argument('--cleanup', action='store_true', help='Remove previously seeded data instead')
+        add_test_db_argument(parser)
+
+    def handle(self, *args, **options):
+        check_test_db(options)
+        cleanup()
+        if options['cleanup']:
+            return
+        for _ in range(options['newsletters']):
+            newsletter = seed_newsletter(options['recipients'])
+            self.stdout.write(f'Created newsletter {newsletter.pk} with {options["recipients"]} recipients')
@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from newsletter.models import Newsletter, OutboxTask
+
+logger = logging.getLogger('newsletter')
+
+# Этапы отправки, время которых измеряется: поиск наступивших рассылок, чтение получателей с записью в outbox,
+# захват задач, отрисовка текстов, открытие SMTP-соединения, отправка письма, запись журнала отправок и итогов
+STAGES = ('query_due', 'load_recipients', 'claim', 'render', 'smtp_connect', 'smtp_send', 'log_write')
+
+# Счетчики событий отправки
+COUNTERS = {
+    'newsletters_scheduled': 'Newsletters put into the outbox',
+    'newsletters_skipped': 'Overdue newsletters moved to their next date without sending',
+    'tasks_completed': 'Outbox tasks completed',
+    'tasks_failed': 'Outbox task attempts aborted by an exception',
+    'messages_sent': 'Messages accepted by the SMTP server',
+    'messages_deferred': 'Messages deferred for a retry after a transient error',
+    'messages_failed': 'Messages that failed permanently',
+}
+
+METRICS_KEY_PREFIX = 'newsletter_metrics'
+
+
+class Metrics:
+    """Счетчики и таймеры этапов отправки, общие для всех процессов.
+
+    Измерения копятся в памяти процесса и переносятся в кеш методом flush() атомарными incr, поэтому таймер
+    на каждое письмо не добавляет обращений к Redis. Время хранится в микросекундах, так как incr целочисленный.
+    """
+
+    def __init__(self):
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._pending[name] += value
+
+    def observe(self, stage, seconds):
+        """Учет одного замера времени этапа"""
+        microseconds = int(seconds * 1_000_000)
+        with self._lock:
+            self._pending[f'{stage}:count'] += 1
+            self._pending[f'{stage}:us'] += microseconds
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages[stage] += seconds
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - started)
+
+    @contextmanager
+    def collect(self):
+        """Сбор времени этапов, измеренных в текущем потоке, для записи в лог: {этап: секунды}"""
+        previous = getattr(self._local, 'stages', None)
+        self._local.stages = stages = defaultdict(float)
+        try:
+            yield stages
+        finally:
+            self._local.stages = previous
+
+    def flush(self):
+        """Перенос накопленных измерений в кеш"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        for name, value in pending.items():
+            key = f'{METRICS_KEY_PREFIX}:{name}'
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, value)
+
+
+metrics = Metrics()
+
+
+def set_scheduler_lag(seconds):
+    """Задержка постановки последней рассылки относительно времени ее запуска"""
+    metrics.observe('scheduler_lag', seconds)
+    cache.set(f'{METRICS_KEY_PREFIX}:scheduler_lag:last', seconds, timeout=None)
+
+
+def log_event(event, **fields):
+    """Структурированная запись в лог в формате logfmt: event=... ключ=значение"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    values = ' '.join(f'{key}={round(value, 4) if isinstance(value, float) else value}'
+                      for key, value in fields.items())
+    logger.info(f'event={event} {values}')
+
+
+def get_queue_depth():
+    """Задачи outbox: всего, наступившие, ожидающие повтора, и возраст самой старой наступившей задачи, с"""
+    now = timezone.now()
+    due = Q(next_attempt_at__lte=now)
+    depth = OutboxTask.objects.aggregate(total=Count('pk'), due=Count('pk', filter=due),
+                                         retrying=Count('pk', filter=Q(attempts__gt=0)),
+                                         oldest=Min('next_attempt_at', filter=due))
+    oldest = depth.pop('oldest')
+    depth['oldest_due_age'] = (now - oldest).total_seconds() if oldest else 0
+    return depth
+
+
+def get_concurrency_window(account=None):
+    """Текущее окно регулятора одновременных SMTP-сессий аккаунта"""
+    return cache.get(f'concurrency_window:{account or settings.EMAIL_HOST_USER}')
+
+
+def set_concurrency_window(account, window):
+    cache.set(f'concurrency_window:{account}', window, timeout=None)
+
+
+def get_overdue_newsletters():
+    """Наступившие, но еще не поставленные в outbox рассылки: количество и опоздание самой старой, с"""
+    now = timezone.now()
+    overdue = Newsletter.objects.filter(is_active=True, status=Newsletter.Status.CREATED,
+                                        next_run_at__lte=now).aggregate(count=Count('pk'), oldest=Min('next_run_at'))
+    return overdue['count'], (now - overdue['oldest']).total_seconds() if overdue['oldest'] else 0
+
+
+def render_prometheus():
+    """Метрики в текстовом формате Prometheus"""
+    names = [f'{stage}:{suffix}' for stage in [*STAGES, 'scheduler_lag'] for suffix in ('count', 'us')]
+    names += [*COUNTERS, 'scheduler_lag:last']
+    values = cache.get_many([f'{METRICS_KEY_PREFIX}:{name}' for name in names])
+
+    def value(name):
+        return values.get(f'{METRICS_KEY_PREFIX}:{name}', 0)
+
+    lines = [
+        '# HELP newsletter_stage_seconds Time spent in each stage of newsletter dispatch',
+        '# TYPE newsletter_stage_seconds summary',
+    ]
+    for stage in STAGES:
+        lines.append(f'newsletter_stage_seconds_sum{{stage="{stage}"}} {value(f"{stage}:us") / 1_000_000}')
+        lines.append(f'newsletter_stage_seconds_count{{stage="{stage}"}} {value(f"{stage}:count")}')
+    for name, description in COUNTERS.items():
+        lines += [f'# HELP newsletter_{name}_total {description}', f'# TYPE newsletter_{name}_total counter',
+                  f'newsletter_{name}_total {value(name)}']
+    lines += [
+        '# HELP newsletter_scheduler_lag_seconds Delay between the planned and actual scheduling of newsletters',
+        '# TYPE newsletter_scheduler_lag_seconds summary',
+        f'newsletter_scheduler_lag_seconds_sum {value("scheduler_lag:us") / 1_000_000}',
+        f'newsletter_scheduler_lag_seconds_count {value("scheduler_lag:count")}',
+        '# HELP newsletter_scheduler_last_lag_seconds Scheduling delay of the most recent newsletter',
+        '# TYPE newsletter_scheduler_last_lag_seconds gauge',
+        f'newsletter_scheduler_last_lag_seconds {value("scheduler_lag:last")}',
+    ]
+    overdue, oldest_overdue_age = get_overdue_newsletters()
+    lines += [
+        '# HELP newsletter_overdue_newsletters Due newsletters not yet put into the outbox',
+        '# TYPE newsletter_overdue_newsletters gauge',
+        f'newsletter_overdue_newsletters {overdue}',
+        '# HELP newsletter_overdue_oldest_seconds How late the oldest overdue newsletter is',
+        '# TYPE newsletter_overdue_oldest_seconds gauge',
+        f'newsletter_overdue_oldest_seconds {oldest_overdue_age}',
+    ]
+    lines += [
+        '# HELP newsletter_smtp_concurrency_window Concurrent SMTP sessions allowed by the adaptive regulator',
+        '# TYPE newsletter_smtp_concurrency_window gauge',
+        f'newsletter_smtp_concurrency_window {int(get_concurrency_window() or 1)}',
+    ]
+    depth = get_queue_depth()
+    lines += [
+        '# HELP newsletter_outbox_tasks Outbox tasks by state',
+        '# TYPE newsletter_outbox_tasks gauge',
+        f'newsletter_outbox_tasks{{state="total"}} {depth["total"]}',
+        f'newsletter_outbox_tasks{{state="due"}} {depth["due"]}',
+        f'newsletter_outbox_tasks{{state="retrying"}} {depth["retrying"]}',
+        '# HELP newsletter_outbox_oldest_due_seconds Age of the oldest outbox task waiting for a sender',
+        '# TYPE newsletter_outbox_oldest_due_seconds gauge',
+        f'newsletter_outbox_oldest_due_seconds {depth["oldest_due_age"]}',
+    ]
+    return '\n'.join(lines) + '\n'
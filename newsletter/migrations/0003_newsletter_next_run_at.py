@@ -0,0 +1,52 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:38
+
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_next_run_at(apps, schema_editor):
+    Newsletter = apps.get_model('newsletter', 'Newsletter')
+    for newsletter in Newsletter.objects.exclude(start_date=None).only('start_date', 'time'):
+        newsletter.next_run_at = timezone.make_aware(datetime.datetime.combine(newsletter.start_date, newsletter.time))
+        newsletter.save(update_fields=['next_run_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='log',
+            name='message',
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='следующий запуск'),
+        ),
+        migrations.AlterField(
+            model_name='log',
+            name='status',
+            field=models.CharField(choices=[('completed', 'Завершена'), ('created', 'Создана'), ('running', 'Запущена')], max_length=25, verbose_name='статус попытки'),
+        ),
+        migrations.AlterField(
+            model_name='newsletter',
+            name='frequency',
+            field=models.CharField(choices=[('daily', 'Раз в день'), ('weekly', 'Раз в неделю'), ('monthly', 'Раз в месяц')], default='daily', max_length=50, verbose_name='периодичность'),
+        ),
+        migrations.AlterField(
+            model_name='newsletter',
+            name='status',
+            field=models.CharField(choices=[('completed', 'Завершена'), ('created', 'Создана'), ('running', 'Запущена')], default='created', max_length=50, verbose_name='статус рассылки'),
+        ),
+        migrations.AddIndex(
+            model_name='newsletter',
+            index=models.Index(fields=['is_active', 'status', 'next_run_at'], name='newsletter_due_idx'),
+        ),
+        migrations.RunPython(fill_next_run_at, migrations.RunPython.noop),
+    ]
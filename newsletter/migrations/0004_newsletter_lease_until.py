@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0003_newsletter_next_run_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='lease_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='захвачена обработчиком до'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fix_log_status(apps, schema_editor):
+    Log = apps.get_model('newsletter', 'Log')
+    for status in ('success', 'failure'):
+        Log.objects.filter(status__startswith=f"('{status}'").update(status=status)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0004_newsletter_lease_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='ошибок'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='окончание отправки'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='sent_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='отправлено'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='начало отправки'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='total_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='получателей'),
+        ),
+        migrations.AlterField(
+            model_name='log',
+            name='status',
+            field=models.CharField(choices=[('success', 'Успешно'), ('failure', 'Ошибка')], max_length=25, verbose_name='статус попытки'),
+        ),
+        migrations.CreateModel(
+            name='Delivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, verbose_name='получатель')),
+                ('status', models.CharField(choices=[('sent', 'Отправлено'), ('failed', 'Ошибка')], max_length=10, verbose_name='статус отправки')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='ошибка')),
+                ('datetime', models.DateTimeField(verbose_name='дата и время отправки')),
+                ('log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='newsletter.log', verbose_name='лог рассылки')),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='newsletter.newsletter', verbose_name='рассылка')),
+            ],
+            options={
+                'verbose_name': 'отправка получателю',
+                'verbose_name_plural': 'отправки получателям',
+                'indexes': [models.Index(fields=['newsletter', 'status'], name='delivery_newsletter_idx')],
+            },
+        ),
+        migrations.RunPython(fix_log_status, migrations.RunPython.noop),
+    ]
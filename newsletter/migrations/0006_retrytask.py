@@ -0,0 +1,35 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0005_delivery'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='delivery',
+            name='status',
+            field=models.CharField(choices=[('sent', 'Отправлено'), ('deferred', 'Отложено'), ('failed', 'Ошибка')], max_length=10, verbose_name='статус отправки'),
+        ),
+        migrations.CreateModel(
+            name='RetryTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emails', models.JSONField(verbose_name='получатели')),
+                ('attempts', models.PositiveIntegerField(default=1, verbose_name='количество попыток')),
+                ('next_attempt_at', models.DateTimeField(db_index=True, verbose_name='следующая попытка')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='последняя ошибка')),
+                ('log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='newsletter.log', verbose_name='лог рассылки')),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='newsletter.newsletter', verbose_name='рассылка')),
+            ],
+            options={
+                'verbose_name': 'повтор отправки',
+                'verbose_name_plural': 'повторы отправки',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0006_retrytask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='версия'),
+        ),
+    ]
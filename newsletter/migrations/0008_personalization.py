@@ -0,0 +1,37 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+def emails_to_recipients(apps, schema_editor):
+    RetryTask = apps.get_model('newsletter', 'RetryTask')
+    for task in RetryTask.objects.all():
+        task.recipients = [[recipient, ''] if isinstance(recipient, str) else recipient
+                           for recipient in task.recipients]
+        task.save(update_fields=['recipients'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0007_message_version'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='retrytask',
+            old_name='emails',
+            new_name='recipients',
+        ),
+        migrations.AlterField(
+            model_name='retrytask',
+            name='recipients',
+            field=models.JSONField(verbose_name='получатели (адрес, имя)'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=models.TextField(blank=True, help_text='Можно использовать подстановки {{ fullname }} и {{ email }} получателя', null=True, verbose_name='тело письма'),
+        ),
+        migrations.RunPython(emails_to_recipients, migrations.RunPython.noop),
+    ]
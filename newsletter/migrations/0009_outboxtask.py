@@ -0,0 +1,41 @@
+# Generated by Django 4.2.6 on 2026-10-18 21:15
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def reopen_retried_logs(apps, schema_editor):
+    """Повторы из прежней очереди теперь завершают лог: их получатели больше не считаются ошибками"""
+    OutboxTask = apps.get_model('newsletter', 'OutboxTask')
+    Log = apps.get_model('newsletter', 'Log')
+    for task in OutboxTask.objects.all():
+        Log.objects.filter(pk=task.log_id).update(failed_count=F('failed_count') - len(task.recipients),
+                                                  finished_at=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0008_personalization'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='RetryTask',
+            new_name='OutboxTask',
+        ),
+        migrations.AlterModelOptions(
+            name='outboxtask',
+            options={'verbose_name': 'задача отправки', 'verbose_name_plural': 'задачи отправки'},
+        ),
+        migrations.AlterField(
+            model_name='outboxtask',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='количество попыток'),
+        ),
+        migrations.RemoveField(
+            model_name='newsletter',
+            name='lease_until',
+        ),
+        migrations.RunPython(reopen_retried_logs, migrations.RunPython.noop),
+    ]
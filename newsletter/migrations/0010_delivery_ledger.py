@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:08
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def keep_last_delivery(apps, schema_editor):
+    """Раньше повторы добавляли новые строки, теперь на получателя в логе остается одна - последняя"""
+    Delivery = apps.get_model('newsletter', 'Delivery')
+    duplicates = (Delivery.objects.values('log', 'email').annotate(count=Count('id'), last_id=Max('id'))
+                  .filter(count__gt=1))
+    for duplicate in duplicates:
+        Delivery.objects.filter(log=duplicate['log'], email=duplicate['email']).exclude(
+            pk=duplicate['last_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0009_outboxtask'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='delivery',
+            name='status',
+            field=models.CharField(choices=[('sending', 'Отправляется'), ('sent', 'Отправлено'), ('deferred', 'Отложено'), ('failed', 'Ошибка')], max_length=10, verbose_name='статус отправки'),
+        ),
+        migrations.RunPython(keep_last_delivery, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='delivery',
+            constraint=models.UniqueConstraint(fields=('log', 'email'), name='delivery_log_email_uniq'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0010_delivery_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='missed_runs',
+            field=models.PositiveIntegerField(default=0, verbose_name='пропущено запусков'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='scheduled_for',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='плановое время запуска'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0011_log_lag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='send_window',
+            field=models.PositiveIntegerField(default=0, help_text='Письма распределяются равномерно на указанное количество минут, 0 - отправить сразу', verbose_name='окно отправки, мин'),
+        ),
+    ]
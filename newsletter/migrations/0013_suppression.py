@@ -0,0 +1,31 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0012_newsletter_send_window'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Suppression',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, unique=True, verbose_name='email')),
+                ('reason', models.CharField(choices=[('unsubscribed', 'Отписка'), ('bounced', 'Постоянная ошибка доставки'), ('complained', 'Жалоба на спам'), ('manual', 'Добавлен вручную')], default='manual', max_length=20, verbose_name='причина')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='дата добавления')),
+            ],
+            options={
+                'verbose_name': 'исключенный адрес',
+                'verbose_name_plural': 'исключенные адреса',
+            },
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='suppressed_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='исключено из рассылки'),
+        ),
+    ]
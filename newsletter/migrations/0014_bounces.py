@@ -0,0 +1,47 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0013_suppression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BounceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True, verbose_name='файл')),
+                ('inode', models.BigIntegerField(verbose_name='inode файла')),
+                ('position', models.BigIntegerField(default=0, verbose_name='обработано байт')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='дата обновления')),
+            ],
+            options={
+                'verbose_name': 'позиция обработки отказов',
+                'verbose_name_plural': 'позиции обработки отказов',
+            },
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='deliverability',
+            field=models.CharField(choices=[('ok', 'Доставляется'), ('soft_bounce', 'Временные отказы'), ('hard_bounce', 'Адрес недоступен')], default='ok', max_length=20, verbose_name='доставляемость'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='last_bounce_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='последний отказ'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='last_bounce_status',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='статус последнего отказа'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='soft_bounces',
+            field=models.PositiveIntegerField(default=0, verbose_name='временных отказов'),
+        ),
+    ]
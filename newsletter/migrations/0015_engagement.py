@@ -0,0 +1,32 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0014_bounces'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Engagement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='дата')),
+                ('opens', models.PositiveIntegerField(default=0, verbose_name='открытий')),
+                ('clicks', models.PositiveIntegerField(default=0, verbose_name='переходов по ссылкам')),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='engagement', to='newsletter.newsletter', verbose_name='рассылка')),
+            ],
+            options={
+                'verbose_name': 'открытия и переходы',
+                'verbose_name_plural': 'открытия и переходы',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='engagement',
+            constraint=models.UniqueConstraint(fields=('newsletter', 'date'), name='engagement_newsletter_date_uniq'),
+        ),
+    ]
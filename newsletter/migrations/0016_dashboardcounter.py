@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0015_engagement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='показатель')),
+                ('value', models.BigIntegerField(default=0, verbose_name='значение')),
+            ],
+            options={
+                'verbose_name': 'счетчик главной страницы',
+                'verbose_name_plural': 'счетчики главной страницы',
+            },
+        ),
+    ]
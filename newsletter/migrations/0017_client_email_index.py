@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0016_dashboardcounter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='client',
+            name='email',
+            field=models.EmailField(db_index=True, max_length=254, verbose_name='контактный email'),
+        ),
+    ]
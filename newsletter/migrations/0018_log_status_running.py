@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0017_client_email_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='log',
+            name='status',
+            field=models.CharField(choices=[('success', 'Успешно'), ('failure', 'Ошибка'), ('running', 'Выполняется')], max_length=25, verbose_name='статус попытки'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0018_log_status_running'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionalMail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=250, verbose_name='тема письма')),
+                ('message', models.TextField(verbose_name='текст письма')),
+                ('recipients', models.JSONField(verbose_name='получатели')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='количество попыток')),
+                ('next_attempt_at', models.DateTimeField(db_index=True, verbose_name='следующая попытка')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='последняя ошибка')),
+            ],
+            options={
+                'verbose_name': 'служебное письмо',
+                'verbose_name_plural': 'служебные письма',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0019_transactionalmail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedBounce',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True, verbose_name='имя письма в Maildir')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='дата обработки')),
+            ],
+            options={
+                'verbose_name': 'обработанное уведомление о недоставке',
+                'verbose_name_plural': 'обработанные уведомления о недоставке',
+            },
+        ),
+    ]
@@ -1,15 +1,28 @@
+import datetime
+
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.utils import timezone
 
 from users.models import NULLABLE
 
 
 class Client(models.Model):
     """Клиент"""
-    email = models.EmailField(verbose_name='контактный email')
+    class Deliverability(models.TextChoices):
+        OK = 'ok', 'Доставляется'
+        SOFT_BOUNCE = 'soft_bounce', 'Временные отказы'
+        HARD_BOUNCE = 'hard_bounce', 'Адрес недоступен'
+
+    email = models.EmailField(db_index=True, verbose_name='контактный email')
     fullname = models.CharField(max_length=150, verbose_name='клиент')
     comment = models.TextField(verbose_name='комментарий', **NULLABLE)
     user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, verbose_name='клиент', **NULLABLE)
+    deliverability = models.CharField(max_length=20, choices=Deliverability.choices, default=Deliverability.OK,
+                                      verbose_name='доставляемость')
+    soft_bounces = models.PositiveIntegerField(default=0, verbose_name='временных отказов')
+    last_bounce_at = models.DateTimeField(verbose_name='последний отказ', **NULLABLE)
+    last_bounce_status = models.CharField(max_length=100, verbose_name='статус последнего отказа', **NULLABLE)
 
     def __str__(self):
         return f'{self.fullname} ({self.email})'
@@ -43,13 +56,33 @@ class Newsletter(models.Model):
     is_active = models.BooleanField(default=True, verbose_name='активность рассылки')
     user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, verbose_name='пользователь', **NULLABLE)
     message = models.ForeignKey('Message', on_delete=models.CASCADE, verbose_name='сообщение')
+    next_run_at = models.DateTimeField(verbose_name='следующий запуск', editable=False, **NULLABLE)
+    send_window = models.PositiveIntegerField(default=0, verbose_name='окно отправки, мин',
+                                              help_text='Письма распределяются равномерно на указанное количество '
+                                                        'минут, 0 - отправить сразу')
 
     def __str__(self):
         return f'{self.name}({self.pk} {self.user}'
 
+    def save(self, *args, **kwargs):
+        """Пересчет времени следующего запуска по дате и времени рассылки"""
+        start_date = self._meta.get_field('start_date').to_python(self.start_date)
+        time = self._meta.get_field('time').to_python(self.time)
+        if start_date:
+            self.next_run_at = timezone.make_aware(datetime.datetime.combine(start_date, time))
+        else:
+            self.next_run_at = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'next_run_at' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'next_run_at']
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'рассылка'
         verbose_name_plural = 'рассылки'
+        indexes = [
+            models.Index(fields=['is_active', 'status', 'next_run_at'], name='newsletter_due_idx'),
+        ]
         permissions = [
             (
                 'change_activity',
@@ -61,12 +94,20 @@ class Newsletter(models.Model):
 class Message(models.Model):
     """Сообщение для рассылки"""
     subject = models.CharField(max_length=100, verbose_name='тема письма', **NULLABLE)
-    content = models.TextField(verbose_name='тело письма', **NULLABLE)
+    content = models.TextField(verbose_name='тело письма', help_text='Можно использовать подстановки {{ fullname }} '
+                                                                      'и {{ email }} получателя', **NULLABLE)
     user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, verbose_name='пользователь', **NULLABLE)
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name='версия')
 
     def __str__(self):
         return self.subject or ''
 
+    def save(self, *args, **kwargs):
+        """Увеличение версии при изменении письма, чтобы сбросить подготовленные для отправки копии"""
+        if self.pk:
+            self.version += 1
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'письмо'
         verbose_name_plural = 'письма'
@@ -77,16 +118,201 @@ class Log(models.Model):
     STATUS_LOG = [
         ('success', 'Успешно'),
         ('failure', 'Ошибка'),
+        ('running', 'Выполняется'),
     ]
 
     datetime = models.DateTimeField(auto_now_add=True, verbose_name='дата и время последней попытки')
-    status = models.CharField(max_length=25, choices=Newsletter.Status.choices, verbose_name='статус попытки')
+    status = models.CharField(max_length=25, choices=STATUS_LOG, verbose_name='статус попытки')
     server_response = models.TextField(verbose_name='ответ сервера', **NULLABLE)
     newsletter = models.ForeignKey(Newsletter, on_delete=models.CASCADE, verbose_name='рассылка')
+    total_count = models.PositiveIntegerField(default=0, verbose_name='получателей')
+    sent_count = models.PositiveIntegerField(default=0, verbose_name='отправлено')
+    failed_count = models.PositiveIntegerField(default=0, verbose_name='ошибок')
+    started_at = models.DateTimeField(verbose_name='начало отправки', **NULLABLE)
+    finished_at = models.DateTimeField(verbose_name='окончание отправки', **NULLABLE)
+    suppressed_count = models.PositiveIntegerField(default=0, verbose_name='исключено из рассылки')
+    scheduled_for = models.DateTimeField(verbose_name='плановое время запуска', **NULLABLE)
+    missed_runs = models.PositiveIntegerField(default=0, verbose_name='пропущено запусков')
 
     def __str__(self):
         return f'рассылка {self.newsletter}, статус: {self.status}'
 
+    @property
+    def duration(self):
+        """Длительность отправки"""
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+
+    @property
+    def lag(self):
+        """Опоздание запуска относительно расписания"""
+        if self.started_at and self.scheduled_for:
+            return self.started_at - self.scheduled_for
+
     class Meta:
         verbose_name = 'лог рассылки'
         verbose_name_plural = 'логи рассылок'
+
+
+def normalize_email(email):
+    """Адрес в виде для сравнения: без пробелов по краям и в нижнем регистре"""
+    return email.strip().lower()
+
+
+class Suppression(models.Model):
+    """Адрес, на который рассылки не отправляются (отписка, постоянная ошибка доставки, жалоба)"""
+    class Reason(models.TextChoices):
+        UNSUBSCRIBED = 'unsubscribed', 'Отписка'
+        BOUNCED = 'bounced', 'Постоянная ошибка доставки'
+        COMPLAINED = 'complained', 'Жалоба на спам'
+        MANUAL = 'manual', 'Добавлен вручную'
+
+    email = models.EmailField(unique=True, verbose_name='email')
+    reason = models.CharField(max_length=20, choices=Reason.choices, default=Reason.MANUAL, verbose_name='причина')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='дата добавления')
+
+    def __str__(self):
+        return f'{self.email} ({self.get_reason_display()})'
+
+    def save(self, *args, **kwargs):
+        self.email = normalize_email(self.email)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        verbose_name = 'исключенный адрес'
+        verbose_name_plural = 'исключенные адреса'
+
+
+class BounceCheckpoint(models.Model):
+    """Позиция, до которой обработан файл mbox с уведомлениями о недоставке"""
+    path = models.CharField(max_length=500, unique=True, verbose_name='файл')
+    inode = models.BigIntegerField(verbose_name='inode файла')
+    position = models.BigIntegerField(default=0, verbose_name='обработано байт')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='дата обновления')
+
+    def __str__(self):
+        return f'{self.path}: {self.position}'
+
+    class Meta:
+        verbose_name = 'позиция обработки отказов'
+        verbose_name_plural = 'позиции обработки отказов'
+
+
+class ProcessedBounce(models.Model):
+    """Письмо Maildir с уведомлением о недоставке, уже учтенное, но еще не перенесенное в cur/"""
+    key = models.CharField(max_length=255, unique=True, verbose_name='имя письма в Maildir')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='дата обработки')
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = 'обработанное уведомление о недоставке'
+        verbose_name_plural = 'обработанные уведомления о недоставке'
+
+
+class Delivery(models.Model):
+    """Результат отправки письма одному получателю.
+
+    Пара (лог, адрес) - ключ идемпотентности: получатель резервируется до отправки письма,
+    и повторный запуск прерванной задачи не отправляет письмо второй раз.
+    """
+    class Status(models.TextChoices):
+        SENDING = 'sending', 'Отправляется'
+        SENT = 'sent', 'Отправлено'
+        DEFERRED = 'deferred', 'Отложено'
+        FAILED = 'failed', 'Ошибка'
+
+    log = models.ForeignKey(Log, on_delete=models.CASCADE, related_name='deliveries', verbose_name='лог рассылки')
+    newsletter = models.ForeignKey(Newsletter, on_delete=models.CASCADE, verbose_name='рассылка')
+    email = models.EmailField(verbose_name='получатель')
+    status = models.CharField(max_length=10, choices=Status.choices, verbose_name='статус отправки')
+    error = models.TextField(verbose_name='ошибка', **NULLABLE)
+    datetime = models.DateTimeField(verbose_name='дата и время отправки')
+
+    def __str__(self):
+        return f'{self.email}: {self.get_status_display()}'
+
+    class Meta:
+        verbose_name = 'отправка получателю'
+        verbose_name_plural = 'отправки получателям'
+        indexes = [
+            models.Index(fields=['newsletter', 'status'], name='delivery_newsletter_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['log', 'email'], name='delivery_log_email_uniq'),
+        ]
+
+
+class OutboxTask(models.Model):
+    """Задача отправки пачки получателей рассылки.
+
+    Задачи записываются планировщиком в одной транзакции с переносом рассылки на следующую дату
+    и разбираются процессами отправки. После временной ошибки задача возвращается в outbox со сдвигом
+    следующей попытки.
+    """
+    log = models.ForeignKey(Log, on_delete=models.CASCADE, verbose_name='лог рассылки')
+    newsletter = models.ForeignKey(Newsletter, on_delete=models.CASCADE, verbose_name='рассылка')
+    recipients = models.JSONField(verbose_name='получатели (адрес, имя)')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='количество попыток')
+    next_attempt_at = models.DateTimeField(db_index=True, verbose_name='следующая попытка')
+    last_error = models.TextField(verbose_name='последняя ошибка', **NULLABLE)
+
+    def __str__(self):
+        return f'отправка рассылки {self.newsletter_id}: {len(self.recipients)} получателей, попыток {self.attempts}'
+
+    class Meta:
+        verbose_name = 'задача отправки'
+        verbose_name_plural = 'задачи отправки'
+
+
+class TransactionalMail(models.Model):
+    """Служебное письмо (регистрация, сброс пароля), отложенное до освобождения лимита отправки аккаунта"""
+    subject = models.CharField(max_length=250, verbose_name='тема письма')
+    message = models.TextField(verbose_name='текст письма')
+    recipients = models.JSONField(verbose_name='получатели')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='количество попыток')
+    next_attempt_at = models.DateTimeField(db_index=True, verbose_name='следующая попытка')
+    last_error = models.TextField(verbose_name='последняя ошибка', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.subject}: {", ".join(self.recipients)}'
+
+    class Meta:
+        verbose_name = 'служебное письмо'
+        verbose_name_plural = 'служебные письма'
+
+
+class Engagement(models.Model):
+    """Открытия писем и переходы по ссылкам рассылки за день.
+
+    Счетчики пополняются пачками из буфера событий в кеше, поэтому отстают от посещений на период переноса.
+    """
+    newsletter = models.ForeignKey(Newsletter, on_delete=models.CASCADE, related_name='engagement',
+                                   verbose_name='рассылка')
+    date = models.DateField(verbose_name='дата')
+    opens = models.PositiveIntegerField(default=0, verbose_name='открытий')
+    clicks = models.PositiveIntegerField(default=0, verbose_name='переходов по ссылкам')
+
+    def __str__(self):
+        return f'{self.newsletter} {self.date}: открытий {self.opens}, переходов {self.clicks}'
+
+    class Meta:
+        verbose_name = 'открытия и переходы'
+        verbose_name_plural = 'открытия и переходы'
+        constraints = [
+            models.UniqueConstraint(fields=['newsletter', 'date'], name='engagement_newsletter_date_uniq'),
+        ]
+
+
+class DashboardCounter(models.Model):
+    """Показатель главной страницы, который поддерживается сигналами, а не считается при каждом просмотре"""
+    name = models.CharField(max_length=50, unique=True, verbose_name='показатель')
+    value = models.BigIntegerField(default=0, verbose_name='значение')
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+    class Meta:
+        verbose_name = 'счетчик главной страницы'
+        verbose_name_plural = 'счетчики главной страницы'
@@ -0,0 +1,59 @@
+from django.core.cache import cache
+
+from newsletter.caching import CacheLock
+
+
+class CacheQueue:
+    """Очередь в кеше: элементы хранятся под последовательными номерами от head + 1 до tail.
+
+    Постановка в очередь - два атомарных обращения к Redis без записи в БД, поэтому подходит для частых событий
+    от посетителей сайта, которые затем переносятся в БД пачками.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def push(self, item):
+        try:
+            index = cache.incr(f'{self.name}:tail')
+        except ValueError:
+            # Первый элемент очереди: счетчика еще нет
+            cache.add(f'{self.name}:tail', 0, timeout=None)
+            index = cache.incr(f'{self.name}:tail')
+        cache.set(f'{self.name}:{index}', item, timeout=None)
+
+    def consume(self, handler, limit=1000):
+        """Передача элементов очереди в handler пачками по limit; возвращает количество переданных.
+
+        Очередь разбирает один процесс за раз, элемент удаляется из очереди после того, как handler его обработал.
+        Номер, который уже выдан, но еще не записан, ожидается до следующего разбора, а если не появится и к нему
+        (процесс упал между incr и set), пропускается.
+        """
+        lock = CacheLock(self.name, timeout=60)
+        if not lock.acquire():
+            return 0
+        consumed = 0
+        try:
+            while True:
+                head = cache.get(f'{self.name}:head', 0)
+                tail = min(cache.get(f'{self.name}:tail', 0), head + limit)
+                if tail <= head:
+                    break
+                keys = [f'{self.name}:{index}' for index in range(head + 1, tail + 1)]
+                items = cache.get_many(keys)
+                done = head
+                for index, key in enumerate(keys, head + 1):
+                    if key not in items and cache.get(f'{self.name}:gap') != index:
+                        cache.set(f'{self.name}:gap', index, timeout=None)
+                        break
+                    done = index
+                batch = [items[key] for key in keys[:done - head] if key in items]
+                handler(batch)
+                cache.set(f'{self.name}:head', done, timeout=None)
+                cache.delete_many(keys[:done - head])
+                consumed += len(batch)
+                if done < tail or tail - head < limit:
+                    break
+        finally:
+            lock.release()
+        return consumed
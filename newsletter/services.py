@@ -1,49 +1,112 @@
 import calendar
 import datetime
+import queue
+import random
+import select
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import formatdate, make_msgid
 
 from django.conf import settings
 from django.contrib.auth.models import Permission
 from django.core.cache import cache
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection, send_mail
+from django.core.mail.message import RFC5322_EMAIL_LINE_LENGTH_LIMIT, sanitize_address
+from django.core.mail.utils import DNS_NAME
+from django.db import connection as db_connection, transaction
+from django.db.models import F, Min
+from django.db.models.functions import Mod
+from django.template import Context, Engine, TemplateSyntaxError
+from django.utils import timezone
+from django_apscheduler import util
 
 from blog.models import Blog
-from newsletter.models import Log, Newsletter, Client
+from newsletter.caching import cached
+from newsletter.metrics import get_concurrency_window, log_event, metrics, set_concurrency_window, set_scheduler_lag
+from newsletter.models import Log, Newsletter, Client, Delivery, OutboxTask, TransactionalMail
+from newsletter.suppression import SuppressionChecker, flush_unsubscribes, get_unsubscribe_url
+from newsletter.tracking import get_open_url, render_html, track_links
 
+# Канал PostgreSQL LISTEN/NOTIFY, через который планировщики узнают об изменении расписания рассылок
+NEWSLETTER_SCHEDULE_CHANNEL = 'newsletter_schedule'
+# Канал, через который процессы отправки узнают о записи новых задач в outbox
+NEWSLETTER_OUTBOX_CHANNEL = 'newsletter_outbox'
 
+# Шаблонизатор для подстановок в тексты писем: без загрузчиков шаблонов и без экранирования HTML
+personalization_engine = Engine(loaders=[], autoescape=False)
+
+# Подпись с персональной ссылкой отписки, добавляемая к тексту писем рассылки
+UNSUBSCRIBE_FOOTER = '\n\n--\nЧтобы отписаться от рассылки, перейдите по ссылке: {url}\n'
+
+
+@cached('blog_articles', timeout=300, invalidated_by=[Blog])
 def get_random_blog_article():
-    """Кеширование объектов блога для главной страницы"""
-    if settings.CACHE_ENABLED:
-        key = 'blog_article'
-        blog_article = cache.get(key)
-        if blog_article is None:
-            blog_article = Blog.objects.order_by('?')[:3]
-            cache.set(key, blog_article)
-    else:
-        blog_article = Blog.objects.order_by('?')[:3]
-    return blog_article
+    """Случайные статьи блога для главной страницы"""
+    return list(Blog.objects.order_by('?')[:3])
 
+
+@cached('newsletter_count', timeout=300, invalidated_by=[Newsletter])
 def get_cache_count_newsletter():
-    if settings.CACHE_ENABLED:
-        key = 'newsletter'
-        newsletter = cache.get(key)
-        if newsletter is None:
-            newsletter = Newsletter.objects.all().count()
-            cache.set(key, newsletter)
-    else:
-        newsletter = Newsletter.objects.all().count()
-    return newsletter
+    return Newsletter.objects.count()
 
 
+@cached('client_count', timeout=300, invalidated_by=[Client])
 def get_cache_count_client():
-    if settings.CACHE_ENABLED:
-        key = 'client'
-        client = cache.get(key)
-        if client is None:
-            client = Client.objects.all().count()
-            cache.set(key, client)
-    else:
-        client = Client.objects.all().count()
-    return client
+    return Client.objects.count()
+
+
+def send_transactional_mail(subject, message, recipient_list):
+    """Отправка служебного письма (регистрация, сброс пароля) с учетом лимитов аккаунта.
+
+    Письмо использует всю квоту аккаунта, включая долю NEWSLETTER_RESERVED_RATE, которую рассылки не занимают.
+    Лимит не ожидается: если места в нем нет, письмо откладывается в TransactionalMail и уходит из планировщика,
+    а запрос пользователя не задерживается.
+    """
+    delay = RateLimiter(settings.EMAIL_HOST_USER).try_acquire()
+    if delay:
+        TransactionalMail.objects.create(subject=subject, message=message, recipients=recipient_list,
+                                         next_attempt_at=timezone.now() + datetime.timedelta(seconds=delay))
+        log_event('transactional_mail_deferred', recipients=len(recipient_list), delay_seconds=delay)
+        return
+    send_mail(subject=subject, message=message, from_email=settings.EMAIL_HOST_USER, recipient_list=recipient_list)
+
+
+def send_transactional_outbox():
+    """Отправка отложенных служебных писем, пока есть место в лимитах аккаунта; возвращает количество отправленных.
+
+    Письмо с ошибкой SMTP повторяется с растущей задержкой, после NEWSLETTER_RETRY_MAX_ATTEMPTS попыток удаляется.
+    """
+    limiter = RateLimiter(settings.EMAIL_HOST_USER)
+    sent = 0
+    with transaction.atomic():
+        mails = list(TransactionalMail.objects.filter(next_attempt_at__lte=timezone.now()).order_by('next_attempt_at')
+                     .select_for_update(skip_locked=True)[:settings.NEWSLETTER_CLAIM_LIMIT])
+        for index, mail in enumerate(mails):
+            delay = limiter.try_acquire()
+            if delay:
+                TransactionalMail.objects.filter(pk__in=[deferred.pk for deferred in mails[index:]]).update(
+                    next_attempt_at=timezone.now() + datetime.timedelta(seconds=delay))
+                break
+            try:
+                send_mail(subject=mail.subject, message=mail.message, from_email=settings.EMAIL_HOST_USER,
+                          recipient_list=mail.recipients)
+            except (smtplib.SMTPException, OSError) as error:
+                mail.attempts += 1
+                log_event('transactional_mail_failed', mail=mail.pk, attempt=mail.attempts, error=repr(error))
+                if mail.attempts >= settings.NEWSLETTER_RETRY_MAX_ATTEMPTS:
+                    mail.delete()
+                else:
+                    mail.last_error = str(error)
+                    mail.next_attempt_at = timezone.now() + get_retry_delay(mail.attempts)
+                    mail.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+            else:
+                mail.delete()
+                sent += 1
+    return sent
 
 
 def add_users_group_permissions(group):
@@ -53,43 +116,893 @@ def add_users_group_permissions(group):
         group.permissions.add(perm)
 
 
-def my_job():
-    """Запуск активных рассылок"""
-    today = datetime.datetime.now()
-    time_now = today.strftime('%H:%M')
-    date_today = today.date()
-    newsletter_today = Newsletter.objects.filter(start_date=date_today, is_active=True, status=Newsletter.Status.CREATED)
-    print(newsletter_today)
-    for newsletter in newsletter_today:
-        newsletter_time = newsletter.time.strftime('%H:%M')
-        print(newsletter)
-        print(newsletter_time)
-
-        if newsletter_time <= time_now:
-            newsletter.status = Newsletter.Status.RUNNING
-            newsletter.save()
-
-            clients = newsletter.clients.all()
-            recipient_list = [client.email for client in clients]
+class SendInterrupted(Exception):
+    """Отправка письма прервалась вместе с процессом; письмо могло быть доставлено, поэтому повторно не отправляется"""
+
+
+class MessageRenderError(Exception):
+    """Текст письма не удалось скомпилировать или отрисовать; повтор отправки не поможет"""
+
+
+class RateLimitExceeded(Exception):
+    """Лимит отправки аккаунта исчерпан дольше, чем допустимо ждать; письмо будет отправлено повторно позже"""
+
+    def __init__(self, account, delay):
+        super().__init__(f'лимит отправки для {account} исчерпан, место освободится через {delay:.0f} с')
+        self.delay = delay
+
+
+class RateLimiter:
+    """Ограничение скорости отправки писем с почтового аккаунта.
+
+    Для каждого периода (секунда, минута, сутки) в кеше ведется счетчик текущего окна. Увеличение счетчика
+    в Redis атомарно, поэтому ограничение общее для всех потоков и процессов, отправляющих с этого аккаунта.
+    reserve - доля лимитов, которую этот отправитель оставляет другим: рассылки не занимают ее, и транзакционные
+    письма с того же аккаунта уходят без ожидания даже во время большой рассылки.
+    """
+    PERIODS = {'second': 1, 'minute': 60, 'day': 86400}
+
+    def __init__(self, account, limits=None, reserve=0.0):
+        self.account = account
+        if limits is None:
+            limits = settings.EMAIL_RATE_LIMITS.get(account, {})
+        self.limits = {period: max(int(limit * (1 - reserve)), 1) for period, limit in limits.items() if limit}
+
+    def _try_acquire(self, now):
+        """Попытка занять место во всех окнах; возвращает 0 или время в секундах до освобождения места"""
+        taken = []
+        for period, limit in self.limits.items():
+            seconds = self.PERIODS[period]
+            window = int(now // seconds)
+            key = f'email_rate:{self.account}:{period}:{window}'
+            cache.add(key, 0, timeout=seconds + 1)
+            taken.append(key)
+            if cache.incr(key) > limit:
+                for taken_key in taken:
+                    cache.decr(taken_key)
+                return (window + 1) * seconds - now
+        return 0
+
+    def try_acquire(self):
+        """Попытка занять место без ожидания; возвращает 0 или время в секундах до освобождения места"""
+        return self._try_acquire(time.time()) if self.limits else 0
+
+    def acquire(self):
+        """Ожидание разрешения на отправку одного письма.
+
+        Если место освободится позже чем через EMAIL_RATE_MAX_WAIT секунд (например, исчерпан суточный лимит),
+        вызывает RateLimitExceeded, чтобы не занимать поток и соединение.
+        """
+        if not self.limits:
+            return
+        while True:
+            delay = self._try_acquire(time.time())
+            if not delay:
+                return
+            if delay > settings.EMAIL_RATE_MAX_WAIT:
+                raise RateLimitExceeded(self.account, delay)
+            time.sleep(delay)
+
+
+class AdaptiveConcurrency:
+    """AIMD-регулятор количества одновременных SMTP-сессий.
+
+    Пока письма уходят без отказов 4xx и быстрее target_latency, окно растет на 1 / окно за каждое письмо
+    (примерно на одну сессию за "круг" по всем сессиям). При отказе 4xx окно уменьшается вдвое, но не чаще раза
+    за target_latency, чтобы одна перегрузка не обнуляла его. Текущее окно сохраняется в кеше: по нему можно следить
+    за регулятором, и с него начинается следующий запуск.
+    """
+
+    def __init__(self, account, maximum, minimum=1, target_latency=None):
+        self.account = account
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target_latency = target_latency or settings.NEWSLETTER_TARGET_LATENCY
+        self.window = min(max(get_concurrency_window(account) or minimum, minimum), maximum)
+        self._in_flight = 0
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Ожидание свободного места в окне"""
+        with self._condition:
+            while self._in_flight >= int(self.window):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, latency, deferred):
+        """Учет результата отправки одного письма"""
+        with self._condition:
+            previous = int(self.window)
+            now = time.monotonic()
+            if deferred:
+                if now - self._last_decrease > self.target_latency:
+                    self.window = max(self.minimum, self.window / 2)
+                    self._last_decrease = now
+            elif latency <= self.target_latency:
+                self.window = min(self.maximum, self.window + 1 / self.window)
+            if int(self.window) != previous:
+                set_concurrency_window(self.account, self.window)
+                log_event('concurrency_changed', account=self.account, previous=previous, window=int(self.window))
+                self._condition.notify_all()
+
+
+class SMTPConnectionPool:
+    """Пул переиспользуемых SMTP-соединений.
+
+    Соединения открываются по мере необходимости, но не больше size штук, и возвращаются в пул после отправки пачки,
+    поэтому рукопожатие TLS и авторизация выполняются один раз на соединение, а не на каждое письмо.
+    Скорость отправки через пул ограничивается лимитами аккаунта EMAIL_HOST_USER за вычетом доли
+    NEWSLETTER_RESERVED_RATE для транзакционных писем, а количество одновременно занятых соединений -
+    окном AdaptiveConcurrency.
+    """
+
+    def __init__(self, size=None):
+        self.size = size or settings.NEWSLETTER_SMTP_POOL_SIZE
+        self.rate_limiter = RateLimiter(settings.EMAIL_HOST_USER, reserve=settings.NEWSLETTER_RESERVED_RATE)
+        self.concurrency = AdaptiveConcurrency(settings.EMAIL_HOST_USER, maximum=self.size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return get_connection()
+        return self._idle.get()
+
+    def _discard(self, connection):
+        connection.close()
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """Выдает открытое соединение из пула и возвращает его обратно после использования"""
+        self.concurrency.acquire()
+        try:
+            connection = self._acquire()
+            try:
+                started = time.monotonic()
+                if connection.open():
+                    metrics.observe('smtp_connect', time.monotonic() - started)
+            except Exception:
+                self._discard(connection)
+                raise
+            try:
+                yield connection
+            except Exception:
+                self._discard(connection)
+                raise
+            self._idle.put(connection)
+        finally:
+            self.concurrency.release()
+
+    def close(self):
+        """Закрытие всех свободных соединений пула"""
+        while True:
             try:
-                response = send_mail(newsletter.message.subject, newsletter.message.content, settings.EMAIL_HOST_USER,
-                                     recipient_list)
-                if response:
-                    log = Log(newsletter=newsletter, status=Log.STATUS_LOG[0], server_response=response)
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+
+
+def get_batches(items, batch_size):
+    """Разбиение последовательности на пачки по batch_size элементов"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def send_batch(connection, messages, rate_limiter=None, concurrency=None):
+    """Отправка пачки писем через одно открытое соединение.
+
+    Письма передаются в send_messages по одному, чтобы ошибка на одном адресе не прерывала отправку остальных.
+    Время и результат отправки каждого письма передаются регулятору concurrency и в метрики.
+    Возвращает список пар (адрес, ошибка), где ошибка None для отправленных писем.
+    """
+    results = []
+    for message in messages:
+        started = time.monotonic()
+        try:
+            if rate_limiter:
+                rate_limiter.acquire()
+                started = time.monotonic()
+            try:
+                connection.send_messages([message])
+            except smtplib.SMTPServerDisconnected:
+                connection.close()
+                connection.open()
+                connection.send_messages([message])
+        except Exception as error:
+            results.append((', '.join(message.to), error))
+            if not isinstance(error, RateLimitExceeded):
+                latency = time.monotonic() - started
+                metrics.observe('smtp_send', latency)
+                if concurrency:
+                    concurrency.record(latency, deferred=is_transient_error(error))
+        else:
+            results.append((', '.join(message.to), None))
+            latency = time.monotonic() - started
+            metrics.observe('smtp_send', latency)
+            if concurrency:
+                concurrency.record(latency, deferred=False)
+    return results
+
+
+def is_transient_error(error):
+    """Временная ли ошибка отправки (ответ 4xx, исчерпан лимит или проблема соединения), которую имеет смысл повторить"""
+    if isinstance(error, RateLimitExceeded):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, response in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, OSError)
+
+
+def get_retry_delay(attempts):
+    """Задержка перед следующей попыткой: экспоненциальный рост с ограничением сверху и случайным разбросом"""
+    delay = min(settings.NEWSLETTER_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.NEWSLETTER_RETRY_MAX_SECONDS)
+    return datetime.timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def is_personalized(content):
+    """Есть ли в тексте письма подстановки шаблона"""
+    return '{{' in content or '{%' in content
+
+
+class PreparedMessage:
+    """Письмо рассылки, закодированное один раз для всех получателей; для получателя собираются только
+    To, Date, Message-ID и персональное тело (подстановки, ссылка отписки, учет открытий и переходов)."""
+
+    def __init__(self, subject, content, from_email, unsubscribe=False, newsletter_id=None):
+        self.subject = subject
+        self.from_email = from_email
+        self.unsubscribe = unsubscribe
+        self.pixel_url = None
+        if newsletter_id is not None:
+            content = track_links(content, newsletter_id)
+            self.pixel_url = get_open_url(newsletter_id)
+        self.content = content
+        self.template = personalization_engine.from_string(content) if is_personalized(content) else None
+        # Тело, которое различается у получателей, кодируется для каждого письма отдельно
+        self.personal_body = self.template is not None or unsubscribe
+        if self.personal_body:
+            self._mime = EmailMessage(subject, '', from_email).message()
+        else:
+            self._mime = self.build_message(content)
+        del self._mime['Date']
+        del self._mime['Message-ID']
+        if unsubscribe:
+            self._mime['List-Unsubscribe-Post'] = 'List-Unsubscribe=One-Click'
+        if self.personal_body:
+            # Тело будет добавлено к заголовкам как есть, в UTF-8
+            del self._mime['Content-Transfer-Encoding']
+            if self.pixel_url is None:
+                self._mime['Content-Transfer-Encoding'] = '8bit'
+            else:
+                self.boundary = f'=={uuid.uuid4().hex}=='
+                self._mime.replace_header('Content-Type', f'multipart/alternative; boundary="{self.boundary}"')
+        self._encoded = {}
+
+    def build_message(self, body, to=(), headers=None):
+        """Письмо Django с текстом body и, если учитываются открытия, его HTML-версией"""
+        if self.pixel_url is None:
+            return EmailMessage(self.subject, body, self.from_email, to, headers=headers).message()
+        return EmailMultiAlternatives(self.subject, body, self.from_email, to, headers=headers,
+                                      alternatives=[(render_html(body, self.pixel_url), 'text/html')]).message()
+
+    def render(self, context):
+        """Текст письма для получателя"""
+        body = self.content if self.template is None else self.template.render(Context(context, autoescape=False))
+        if self.unsubscribe:
+            body += UNSUBSCRIBE_FOOTER.format(url=context['unsubscribe_url'])
+        return body
+
+    def encoded(self, linesep):
+        """Закодированные общие заголовки и тело письма (для персонализированного письма - только заголовки)"""
+        encoded = self._encoded.get(linesep)
+        if encoded is None:
+            encoded = self._encoded[linesep] = self._mime.as_bytes(linesep=linesep)
+        return encoded
+
+    def encode_body(self, body, linesep):
+        """Тело персонализированного письма в UTF-8: текст или, если учитываются открытия, текст и HTML-версия"""
+        if self.pixel_url is not None:
+            part = f'Content-Type: text/{{}}; charset="{settings.DEFAULT_CHARSET}"\n' \
+                   f'Content-Transfer-Encoding: 8bit\n\n'
+            body = (f'--{self.boundary}\n{part.format("plain")}{body}\n'
+                    f'--{self.boundary}\n{part.format("html")}{render_html(body, self.pixel_url)}\n'
+                    f'--{self.boundary}--\n')
+        return body.replace('\r\n', '\n').replace('\n', linesep).encode(settings.DEFAULT_CHARSET)
+
+    def get_headers(self, unsubscribe_url):
+        """Заголовки письма, которые различаются у получателей, кроме To, Date и Message-ID"""
+        return {'List-Unsubscribe': f'<{unsubscribe_url}>'} if unsubscribe_url else {}
+
+    def as_bytes(self, to, body, linesep='\n', unsubscribe_url=None):
+        """Письмо для получателя to с текстом body"""
+        headers = (f'To: {sanitize_address(to, settings.DEFAULT_CHARSET)}{linesep}'
+                   f'Date: {formatdate(localtime=settings.EMAIL_USE_LOCALTIME)}{linesep}'
+                   f'Message-ID: {make_msgid(domain=DNS_NAME)}{linesep}')
+        for name, value in self.get_headers(unsubscribe_url).items():
+            headers += f'{name}: {value}{linesep}'
+        headers = headers.encode('ascii')
+        if not self.personal_body:
+            return headers + self.encoded(linesep)
+
+        encoded_body = self.encode_body(body, linesep)
+        if any(len(line) > RFC5322_EMAIL_LINE_LENGTH_LIMIT for line in encoded_body.split(linesep.encode())):
+            # Слишком длинные строки требуют quoted-printable, такое письмо собирается целиком
+            message = self.build_message(body, [to], self.get_headers(unsubscribe_url))
+            if self.unsubscribe:
+                message['List-Unsubscribe-Post'] = 'List-Unsubscribe=One-Click'
+            return message.as_bytes(linesep=linesep)
+        return headers + self.encoded(linesep) + encoded_body
+
+
+class PreparedMIMEMessage:
+    """Письмо одному получателю на основе PreparedMessage, в том виде, в котором его ожидают почтовые бэкенды"""
+
+    def __init__(self, prepared, to, body, unsubscribe_url=None):
+        self.prepared = prepared
+        self.to = to
+        self.body = body
+        self.unsubscribe_url = unsubscribe_url
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        return self.prepared.as_bytes(self.to, self.body, linesep, self.unsubscribe_url)
+
+    def as_string(self, unixfrom=False, linesep='\n'):
+        return self.as_bytes(linesep=linesep).decode(settings.DEFAULT_CHARSET)
+
+
+class PreparedEmailMessage(EmailMessage):
+    """Письмо рассылки одному получателю, не собирающее MIME заново"""
+
+    def __init__(self, prepared, to, fullname=''):
+        self.unsubscribe_url = get_unsubscribe_url(to) if prepared.unsubscribe else None
+        context = {'email': to, 'fullname': fullname, 'unsubscribe_url': self.unsubscribe_url}
+        super().__init__(prepared.subject, prepared.render(context), prepared.from_email, [to])
+        self.prepared = prepared
+
+    def message(self):
+        return PreparedMIMEMessage(self.prepared, self.to[0], self.body, self.unsubscribe_url)
+
+
+_prepared_messages = {}
+
+
+def get_prepared_message(message, newsletter_id):
+    """Подготовленное письмо для пары (Message, версия); собирается один раз и переиспользуется между запусками.
+
+    Ссылки учета открытий и переходов у каждой рассылки свои, поэтому с NEWSLETTER_TRACKING письмо готовится
+    для каждой рассылки отдельно.
+    """
+    newsletter_id = newsletter_id if settings.NEWSLETTER_TRACKING else None
+    key = (message.pk, message.version, newsletter_id)
+    prepared = _prepared_messages.get(key)
+    if prepared is None:
+        try:
+            prepared = PreparedMessage(message.subject or '', message.content or '', settings.EMAIL_HOST_USER,
+                                       unsubscribe=settings.NEWSLETTER_UNSUBSCRIBE_LINKS, newsletter_id=newsletter_id)
+        except TemplateSyntaxError as error:
+            raise MessageRenderError(f'ошибка в шаблоне письма {message.pk}: {error}') from error
+        if len(_prepared_messages) >= settings.NEWSLETTER_PREPARED_CACHE_SIZE:
+            _prepared_messages.clear()
+        _prepared_messages[key] = prepared
+    return prepared
+
+
+def deliver(prepared, recipients, pool):
+    """Отправка каждому получателю (адрес, имя) отдельного письма через соединение из пула.
+
+    Тексты писем пачки отрисовываются здесь же, в рабочем потоке. Получатель, письмо которому не удалось
+    отрисовать, получает постоянную ошибку MessageRenderError, остальным письма отправляются. Возвращает пары
+    (получатель, ошибка).
+    """
+    messages, render_errors = [], {}
+    with metrics.timer('render'):
+        for index, (email, fullname) in enumerate(recipients):
+            try:
+                messages.append(PreparedEmailMessage(prepared, email, fullname))
+            except Exception as error:
+                render_errors[index] = MessageRenderError(f'не удалось отрисовать письмо: {error!r}')
+    if not messages:
+        return [(recipient, render_errors[index]) for index, recipient in enumerate(recipients)]
+    try:
+        with pool.connection() as connection:
+            results = iter(send_batch(connection, messages, pool.rate_limiter, pool.concurrency))
+    except Exception as error:
+        return [(recipient, render_errors.get(index, error)) for index, recipient in enumerate(recipients)]
+    return [(recipient, render_errors[index] if index in render_errors else next(results)[1])
+            for index, recipient in enumerate(recipients)]
+
+
+def reserve_recipients(task, recipients):
+    """Резервирование в Delivery получателей, которым письмо еще не отправлялось; возвращает (к отправке,
+    прерванные, пропущено отправленных, пропущено неотправленных) или None, если задача уже выполнена."""
+    with transaction.atomic():
+        if not OutboxTask.objects.select_for_update().filter(pk=task.pk).exists():
+            return None
+        known = dict(Delivery.objects.filter(log_id=task.log_id, email__in=[email for email, fullname in recipients])
+                     .values_list('email', 'status'))
+        pending, interrupted, delivered, failed = {}, [], 0, 0
+        for email, fullname in recipients:
+            status = known.get(email, Delivery.Status.DEFERRED)
+            if status == Delivery.Status.SENT:
+                delivered += 1
+            elif status == Delivery.Status.DEFERRED:
+                pending[email] = (email, fullname)
+            elif status == Delivery.Status.SENDING:
+                interrupted.append((email, fullname))
+            else:
+                failed += 1
+        now = timezone.now()
+        Delivery.objects.bulk_create(
+            [Delivery(log_id=task.log_id, newsletter_id=task.newsletter_id, email=email, datetime=now,
+                      status=Delivery.Status.SENDING) for email in pending],
+            update_conflicts=True, unique_fields=['log', 'email'], update_fields=['status', 'datetime'])
+    return list(pending.values()), interrupted, delivered, failed
+
+
+def confirm_sent(task, results):
+    """Отметка в журнале отправок писем, которые приняты SMTP-сервером, до завершения всей задачи"""
+    Delivery.objects.filter(log_id=task.log_id, email__in=[email for (email, fullname), error in results
+                                                           if error is None]).update(status=Delivery.Status.SENT)
+
+
+def record_deliveries(log_id, newsletter_id, results, attempts):
+    """Запись результатов пачки в журнал отправок одним bulk_create.
+
+    Получатели с временной ошибкой, если попытки еще не исчерпаны, помечаются отложенными и возвращаются
+    в outbox новой задачей. Отложенные из-за лимита отправки аккаунта (RateLimitExceeded) попыткой не считаются
+    и возвращаются отдельной задачей не раньше, чем в лимите освободится место. Возвращает количество отправленных
+    писем и окончательных ошибок.
+    """
+    now = timezone.now()
+    rate_limited = [(recipient, error) for recipient, error in results if isinstance(error, RateLimitExceeded)]
+    retried = []
+    if attempts < settings.NEWSLETTER_RETRY_MAX_ATTEMPTS:
+        retried = [(recipient, error) for recipient, error in results
+                   if error and is_transient_error(error) and not isinstance(error, RateLimitExceeded)]
+    deferred = rate_limited + retried
+    deferred_emails = {email for (email, fullname), error in deferred}
+
+    deliveries = {}
+    for (email, fullname), error in results:
+        if error is None:
+            status = Delivery.Status.SENT
+        elif email in deferred_emails:
+            status = Delivery.Status.DEFERRED
+        else:
+            status = Delivery.Status.FAILED
+        # Одна строка на адрес: ON CONFLICT DO UPDATE не обновляет строку дважды за запрос
+        deliveries.setdefault(email, Delivery(log_id=log_id, newsletter_id=newsletter_id, email=email, datetime=now,
+                                              status=status, error=str(error) if error else None))
+    Delivery.objects.bulk_create(deliveries.values(), batch_size=settings.NEWSLETTER_BATCH_SIZE, update_conflicts=True,
+                                 unique_fields=['log', 'email'], update_fields=['status', 'error', 'datetime'])
+
+    tasks = []
+    if retried:
+        tasks.append(OutboxTask(log_id=log_id, newsletter_id=newsletter_id,
+                                recipients=[list(recipient) for recipient, error in retried],
+                                attempts=attempts, next_attempt_at=now + get_retry_delay(attempts),
+                                last_error=str(retried[-1][1])))
+    if rate_limited:
+        delay = datetime.timedelta(seconds=max(error.delay for recipient, error in rate_limited))
+        tasks.append(OutboxTask(log_id=log_id, newsletter_id=newsletter_id,
+                                recipients=[list(recipient) for recipient, error in rate_limited],
+                                attempts=attempts - 1, next_attempt_at=now + max(delay, get_retry_delay(attempts)),
+                                last_error=str(rate_limited[-1][1])))
+    OutboxTask.objects.bulk_create(tasks)
+    sent = sum(1 for recipient, error in results if error is None)
+    return sent, len(results) - sent - len(deferred)
+
+
+def iter_recipients(newsletter):
+    """Потоковое чтение получателей рассылки (адрес, имя) без создания объектов Client и без повторов адреса"""
+    recipients = newsletter.clients.values('email').annotate(name=Min('fullname')).order_by()
+    return recipients.values_list('email', 'name').iterator(chunk_size=settings.NEWSLETTER_RECIPIENT_CHUNK_SIZE)
+
+
+def unique_recipients(recipients):
+    """Получатели (адрес, имя) без повторов адреса, в порядке первого появления"""
+    unique = {}
+    for email, fullname in recipients:
+        unique.setdefault(email, (email, fullname))
+    return list(unique.values())
+
+
+def get_next_start_date(newsletter, now):
+    """Ближайшая дата рассылки после now с учетом периодичности и количество пропущенных до нее запусков.
+
+    Пропущенные запуски (например, если планировщик не работал) не повторяются: рассылка отправляется один раз.
+    """
+    start_date = newsletter.start_date
+    missed = 0
+    while True:
+        if newsletter.frequency == Newsletter.Frequency.WEEKLY:
+            start_date += datetime.timedelta(days=7)
+        elif newsletter.frequency == Newsletter.Frequency.MONTHLY:
+            start_date += datetime.timedelta(days=calendar.monthrange(start_date.year, start_date.month)[1])
+        else:
+            start_date += datetime.timedelta(days=1)
+        next_run_at = timezone.make_aware(datetime.datetime.combine(start_date, newsletter.time))
+        if next_run_at > now:
+            return start_date, missed
+        missed += 1
+
+
+def pg_notify(channel, payload=''):
+    """PostgreSQL NOTIFY: уведомление доставляется слушателям только после фиксации текущей транзакции
+    и отбрасывается при ее откате. На других СУБД ничего не делает."""
+    if db_connection.vendor != 'postgresql':
+        return
+    with db_connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [channel, payload])
+
+
+def notify_schedule_changed(newsletter_id):
+    """Уведомление запущенных планировщиков об изменении расписания рассылки.
+
+    На СУБД кроме PostgreSQL планировщики работают в режиме опроса (run_apscheduler --poll),
+    и уведомление не отправляется.
+    """
+    pg_notify(NEWSLETTER_SCHEDULE_CHANNEL, str(newsletter_id))
+
+
+def get_scheduled_newsletters(newsletter_ids=None):
+    """Время запуска активных рассылок, ожидающих отправки: {id рассылки: next_run_at}"""
+    newsletters = Newsletter.objects.filter(is_active=True, status=Newsletter.Status.CREATED,
+                                            next_run_at__isnull=False)
+    if newsletter_ids is not None:
+        newsletters = newsletters.filter(pk__in=newsletter_ids)
+    return dict(newsletters.values_list('pk', 'next_run_at'))
+
+
+def get_due_newsletters(now):
+    """Активные рассылки, время запуска которых наступило, включая просроченные (индекс newsletter_due_idx)"""
+    return Newsletter.objects.filter(is_active=True, status=Newsletter.Status.CREATED,
+                                     next_run_at__lte=now).order_by('next_run_at')
+
+
+def write_outbox(newsletter, log, now):
+    """Запись получателей рассылки в outbox пачками по NEWSLETTER_BATCH_SIZE.
+
+    Получатели читаются потоково и записываются порциями, поэтому расход памяти не зависит от размера рассылки.
+    Адреса из списка исключений (Suppression) отбрасываются по пути. Возвращает количество записанных
+    и исключенных получателей.
+    Если у рассылки задано окно отправки, время первой попытки пачек распределяется по нему равномерно,
+    и процессы отправки забирают их постепенно, а не все сразу.
+    """
+    total = 0
+    window = datetime.timedelta(minutes=newsletter.send_window)
+    recipients_count = newsletter.clients.values('email').distinct().count() if window else 0
+    tasks_per_chunk = max(settings.NEWSLETTER_RECIPIENT_CHUNK_SIZE // settings.NEWSLETTER_BATCH_SIZE, 1)
+    suppressions = SuppressionChecker()
+    recipients = (recipient for chunk in get_batches(iter_recipients(newsletter), settings.NEWSLETTER_BATCH_SIZE)
+                  for recipient in suppressions.filter(chunk))
+    batches = get_batches(recipients, settings.NEWSLETTER_BATCH_SIZE)
+    for chunk in get_batches(batches, tasks_per_chunk):
+        tasks = []
+        for batch in chunk:
+            next_attempt_at = now + window * total / recipients_count if recipients_count else now
+            tasks.append(OutboxTask(log=log, newsletter=newsletter, next_attempt_at=next_attempt_at,
+                                    recipients=[list(recipient) for recipient in batch]))
+            total += len(batch)
+        OutboxTask.objects.bulk_create(tasks)
+    return total, suppressions.suppressed
+
+
+def finish_log(log_id):
+    """Итоги рассылки после обработки всех ее задач; рассылка снова ожидает следующего запуска"""
+    log = Log.objects.get(pk=log_id)
+    log.finished_at = timezone.now()
+    log.status = Log.STATUS_LOG[0][0] if log.sent_count else Log.STATUS_LOG[1][0]
+    log.server_response = f'Отправлено писем: {log.sent_count} из {log.total_count}, ошибок: {log.failed_count}'
+    if log.suppressed_count:
+        log.server_response += f', исключено из рассылки: {log.suppressed_count}'
+    log.save()
+    if Newsletter.objects.filter(pk=log.newsletter_id, status=Newsletter.Status.RUNNING).update(
+            status=Newsletter.Status.CREATED):
+        notify_schedule_changed(log.newsletter_id)
+
+
+def schedule_due_newsletters(now, newsletter_ids=None, max_lag=None):
+    """Постановка наступивших рассылок в outbox порциями по NEWSLETTER_CATCHUP_BATCH; рассылки, опоздавшие
+    больше чем на max_lag секунд, пропускаются до следующей даты. Возвращает поставленные в outbox рассылки."""
+    if max_lag is None:
+        max_lag = settings.NEWSLETTER_MAX_LAG or None
+    # Отписки, еще не перенесенные из очереди, тоже должны исключить адреса; перенос - до транзакции порции
+    flush_unsubscribes()
+    due = get_due_newsletters(now)
+    if newsletter_ids is not None:
+        due = due.filter(pk__in=newsletter_ids)
+    scheduled = []
+    while True:
+        with metrics.collect() as stages, transaction.atomic():
+            with metrics.timer('query_due'):
+                newsletters = list(due.select_for_update(skip_locked=True)[:settings.NEWSLETTER_CATCHUP_BATCH])
+            if not newsletters:
+                break
+            started_at = timezone.now()
+            logs, lags, skipped = [], {}, []
+            for newsletter in newsletters:
+                lags[newsletter.pk] = (started_at - newsletter.next_run_at).total_seconds()
+                start_date, missed_runs = get_next_start_date(newsletter, now)
+                log = Log(newsletter=newsletter, status=Log.STATUS_LOG[2][0], started_at=now,
+                          scheduled_for=newsletter.next_run_at, missed_runs=missed_runs)
+                if max_lag is not None and lags[newsletter.pk] > max_lag:
+                    log.status, log.finished_at = Log.STATUS_LOG[1][0], started_at
+                    log.server_response = f'Запуск пропущен: опоздание {lags[newsletter.pk]:.0f} с больше ' \
+                                          f'допустимого ({max_lag} с)'
+                    skipped.append(newsletter)
                 else:
-                    log = Log(newsletter=newsletter, status=Log.STATUS_LOG[1], server_response=response)
-                log.save()
-            except Exception as response:
-                log = Log(newsletter=newsletter, status=Log.STATUS_LOG[1], server_response=response)
-                log.save()
-
-            if newsletter.frequency == Newsletter.Frequency.DAILY:
-                newsletter.start_date = date_today + datetime.timedelta(days=1)
-            elif newsletter.frequency == Newsletter.Frequency.WEEKLY:
-                newsletter.start_date = date_today + datetime.timedelta(days=7)
-            elif newsletter.frequency == Newsletter.Frequency.MONTHLY:
-                days_in_month = calendar.monthrange(today.year, today.month)[1]
-                newsletter.start_date = date_today + datetime.timedelta(days=days_in_month)
-
-            newsletter.status = newsletter.Status.CREATED
-            newsletter.save()
+                    newsletter.status = Newsletter.Status.RUNNING
+                logs.append(log)
+                newsletter.start_date = start_date
+                newsletter.next_run_at = timezone.make_aware(datetime.datetime.combine(start_date, newsletter.time))
+            Log.objects.bulk_create(logs)
+            Newsletter.objects.bulk_update(newsletters, ['start_date', 'next_run_at', 'status'])
+
+            with metrics.timer('load_recipients'):
+                for newsletter, log in zip(newsletters, logs):
+                    if newsletter.status == Newsletter.Status.RUNNING:
+                        log.total_count, log.suppressed_count = write_outbox(newsletter, log, now)
+            Log.objects.bulk_update(logs, ['total_count', 'suppressed_count'])
+            for newsletter, log in zip(newsletters, logs):
+                # bulk_update не вызывает post_save, поэтому планировщики уведомляются здесь
+                notify_schedule_changed(newsletter.pk)
+                if newsletter.status == Newsletter.Status.RUNNING and not log.total_count:
+                    finish_log(log.pk)
+            if any(log.total_count for log in logs):
+                pg_notify(NEWSLETTER_OUTBOX_CHANNEL)
+
+        for newsletter, log in zip(newsletters, logs):
+            set_scheduler_lag(lags[newsletter.pk])
+            log_event('newsletter_skipped' if newsletter in skipped else 'newsletter_scheduled',
+                      newsletter=newsletter.pk, log=log.pk, recipients=log.total_count,
+                      lag_seconds=lags[newsletter.pk], missed_runs=log.missed_runs)
+        scheduled += [newsletter for newsletter in newsletters if newsletter not in skipped]
+        metrics.incr('newsletters_scheduled', len(newsletters) - len(skipped))
+        metrics.incr('newsletters_skipped', len(skipped))
+        metrics.flush()
+        log_event('schedule_batch', newsletters=len(newsletters), skipped=len(skipped),
+                  **{f'{stage}_seconds': seconds for stage, seconds in stages.items()})
+    return scheduled
+
+
+def claim_outbox_tasks(now, shard=None):
+    """Атомарный захват наступивших задач outbox текущим процессом.
+
+    Строки блокируются через SELECT ... FOR UPDATE SKIP LOCKED, поэтому процессы отправки разбирают разные задачи.
+    Следующая попытка захваченной задачи сдвигается на время аренды: если процесс завершится, не закончив ее,
+    задачу заберет другой. shard = (номер, количество) оставляет только задачи, у которых id % количество == номер,
+    так что пачки одной большой рассылки расходятся по всем шардам.
+    """
+    tasks = OutboxTask.objects.filter(next_attempt_at__lte=now)
+    if shard is not None:
+        index, count = shard
+        tasks = tasks.annotate(shard=Mod('pk', count)).filter(shard=index)
+    with metrics.timer('claim'), transaction.atomic():
+        tasks = list(tasks.order_by('next_attempt_at').select_related('newsletter__message')
+                     .select_for_update(skip_locked=True, of=('self',))[:settings.NEWSLETTER_CLAIM_LIMIT])
+        OutboxTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+            next_attempt_at=now + datetime.timedelta(seconds=settings.NEWSLETTER_LEASE_SECONDS))
+    return tasks
+
+
+def renew_lease(tasks):
+    """Продление аренды задач, отправка которых еще идет"""
+    OutboxTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+        next_attempt_at=timezone.now() + datetime.timedelta(seconds=settings.NEWSLETTER_LEASE_SECONDS))
+
+
+def release_lease(tasks):
+    """Возврат невыполненных задач в outbox без ожидания окончания аренды"""
+    OutboxTask.objects.filter(pk__in=[task.pk for task in tasks]).update(next_attempt_at=timezone.now())
+
+
+@contextmanager
+def lease_heartbeat(tasks):
+    """Продление аренды задач в фоновом потоке, пока идет их отправка"""
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(settings.NEWSLETTER_LEASE_SECONDS / 3):
+            renew_lease(tasks)
+        db_connection.close()
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def complete_task(task, results, delivered=0, failed=0, duplicates=0):
+    """Учет результатов задачи в одной транзакции; возвращает (отправлено, отложено, не отправлено) или None,
+    если задача уже завершена другим процессом. duplicates - повторы адреса, вычитаемые из получателей лога."""
+    with transaction.atomic():
+        if not OutboxTask.objects.filter(pk=task.pk).delete()[0]:
+            return None
+        sent, not_sent = record_deliveries(task.log_id, task.newsletter_id, results, task.attempts + 1)
+        Log.objects.filter(pk=task.log_id).update(sent_count=F('sent_count') + sent + delivered,
+                                                  failed_count=F('failed_count') + not_sent + failed,
+                                                  total_count=F('total_count') - duplicates)
+        if not OutboxTask.objects.filter(log_id=task.log_id).exists():
+            finish_log(task.log_id)
+    deferred = len(results) - sent - not_sent
+    metrics.incr('tasks_completed')
+    metrics.incr('messages_sent', sent)
+    metrics.incr('messages_deferred', deferred)
+    metrics.incr('messages_failed', not_sent)
+    return sent, deferred, not_sent
+
+
+@util.close_old_connections
+def send_task(task, pool):
+    """Отправка задачи outbox в рабочем потоке.
+
+    Получатели резервируются и подтверждаются в журнале отправок порциями по NEWSLETTER_RESERVE_SIZE, поэтому
+    задача, прерванная вместе с процессом, продолжается с места остановки. Получатели, отправка которым была
+    прервана, учитываются как ошибки без повторной отправки: больше одного письма получатель не получит,
+    в том числе если его адрес повторяется в задаче. Время этапов и итоги задачи записываются в метрики и в лог.
+    """
+    try:
+        prepared = get_prepared_message(task.newsletter.message, task.newsletter_id)
+    except MessageRenderError as error:
+        # Письмо с ошибкой в шаблоне не отправляется никому: получатели учитываются как постоянные ошибки
+        prepared, render_error = None, error
+    task_recipients = unique_recipients(task.recipients)
+    results, delivered, failed = [], 0, 0
+    with metrics.collect() as stages:
+        for chunk in get_batches(task_recipients, settings.NEWSLETTER_RESERVE_SIZE):
+            with metrics.timer('log_write'):
+                reserved = reserve_recipients(task, chunk)
+            if reserved is None:
+                return
+            recipients, interrupted, chunk_delivered, chunk_failed = reserved
+            if recipients:
+                if prepared is None:
+                    chunk_results = [(recipient, render_error) for recipient in recipients]
+                else:
+                    chunk_results = deliver(prepared, recipients, pool)
+                with metrics.timer('log_write'):
+                    confirm_sent(task, chunk_results)
+                results += chunk_results
+            results += [(recipient, SendInterrupted('Отправка прервана, письмо могло быть доставлено'))
+                        for recipient in interrupted]
+            delivered += chunk_delivered
+            failed += chunk_failed
+        with metrics.timer('log_write'):
+            counts = complete_task(task, results, delivered, failed, len(task.recipients) - len(task_recipients))
+    metrics.flush()
+    if counts is not None:
+        sent, deferred, not_sent = counts
+        log_event('task_completed', task=task.pk, newsletter=task.newsletter_id, log=task.log_id,
+                  attempt=task.attempts + 1, recipients=len(task_recipients), sent=sent, deferred=deferred,
+                  failed=not_sent, skipped=delivered + failed,
+                  **{f'{stage}_seconds': seconds for stage, seconds in stages.items()})
+
+
+def fail_task(task, error):
+    """Учет исключения, прервавшего отправку задачи: задача повторяется позже, а после последней попытки
+    ее получатели, которым письмо еще не отправлено, учитываются как ошибки, чтобы рассылка завершилась.
+
+    Получатели, зарезервированные прерванной попыткой, при повторе не получат письмо еще раз.
+    """
+    attempts = task.attempts + 1
+    log_event('task_failed', task=task.pk, newsletter=task.newsletter_id, log=task.log_id, attempt=attempts,
+              error=repr(error))
+    metrics.incr('tasks_failed')
+    if attempts < settings.NEWSLETTER_RETRY_MAX_ATTEMPTS:
+        OutboxTask.objects.filter(pk=task.pk).update(attempts=attempts, last_error=str(error),
+                                                     next_attempt_at=timezone.now() + get_retry_delay(attempts))
+        return
+    recipients = unique_recipients(task.recipients)
+    known = dict(Delivery.objects.filter(log_id=task.log_id, email__in=[email for email, fullname in recipients],
+                                         status__in=[Delivery.Status.SENT, Delivery.Status.FAILED])
+                 .values_list('email', 'status'))
+    results = [(recipient, error) for recipient in recipients if recipient[0] not in known]
+    delivered = sum(1 for email, fullname in recipients if known.get(email) == Delivery.Status.SENT)
+    complete_task(task, results, delivered, len(recipients) - len(results) - delivered,
+                  len(task.recipients) - len(recipients))
+
+
+def send_outbox(shard=None):
+    """Отправка задач outbox, пока есть наступившие. Возвращает количество обработанных задач.
+
+    Задачи захватываются по NEWSLETTER_CLAIM_LIMIT и отправляются параллельно в NEWSLETTER_WORKERS потоках
+    через общий пул SMTP-соединений, поэтому процессов отправки может быть запущено сколько угодно.
+    Исключение при отправке одной задачи не прерывает остальные: задача повторяется позже (fail_task).
+    """
+    processed = 0
+    tasks = []
+    pool = SMTPConnectionPool()
+    try:
+        with ThreadPoolExecutor(max_workers=settings.NEWSLETTER_WORKERS) as executor:
+            try:
+                while tasks := claim_outbox_tasks(timezone.now(), shard):
+                    with lease_heartbeat(tasks):
+                        futures = [executor.submit(send_task, task, pool) for task in tasks]
+                        for task, future in zip(tasks, futures):
+                            try:
+                                future.result()
+                            except Exception as error:
+                                fail_task(task, error)
+                    processed += len(tasks)
+            except BaseException:
+                # Остановленный процесс сразу отдает невыполненные задачи другим, не дожидаясь окончания аренды
+                executor.shutdown(cancel_futures=True)
+                release_lease(tasks)
+                raise
+    finally:
+        pool.close()
+        metrics.flush()
+    return processed
+
+
+def wait_for_outbox(timeout):
+    """Ожидание новых задач outbox, но не дольше timeout секунд и не дольше ближайшей отложенной попытки.
+
+    На PostgreSQL ожидание прерывается уведомлением планировщика о записи задач, на других СУБД это пауза.
+    """
+    listener = None
+    if db_connection.vendor == 'postgresql':
+        with db_connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {NEWSLETTER_OUTBOX_CHANNEL}')
+        listener = db_connection.connection
+    next_attempt_at = OutboxTask.objects.aggregate(next_attempt_at=Min('next_attempt_at'))['next_attempt_at']
+    if next_attempt_at is not None:
+        timeout = min(timeout, max((next_attempt_at - timezone.now()).total_seconds(), 0))
+    if listener is None:
+        time.sleep(timeout)
+        return
+    if not listener.notifies:
+        select.select([listener], [], [], timeout)
+        listener.poll()
+    listener.notifies.clear()
+
+
+def my_job():
+    """Постановка наступивших рассылок в outbox.
+
+    Отправкой занимаются отдельные процессы run_newsletter, поэтому медленный SMTP-сервер не задерживает
+    планирование, а планировщик и отправка масштабируются и падают независимо. Возвращает поставленные рассылки.
+    """
+    newsletter_due = schedule_due_newsletters(timezone.now())
+    if newsletter_due:
+        log_event('newsletters_due', newsletters=','.join(str(newsletter.pk) for newsletter in newsletter_due))
+    return newsletter_due
+
+
+@util.close_old_connections
+def newsletter_job(newsletter_id):
+    """Постановка рассылки в outbox по ее собственному триггеру.
+
+    Триггер рассылки есть в каждом запущенном планировщике, рассылку ставит тот, кто первым ее заблокирует.
+    """
+    newsletters = schedule_due_newsletters(timezone.now(), [newsletter_id])
+    if newsletters:
+        log_event('newsletters_due', newsletters=','.join(str(newsletter.pk) for newsletter in newsletters))
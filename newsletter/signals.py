@@ -0,0 +1,60 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from newsletter.dashboard import (change_dashboard_counters, client_added, clients_removed, defer_to_commit,
+                                  newsletters_deleted)
+from newsletter.models import Client, Newsletter
+from newsletter.services import notify_schedule_changed
+
+
+@receiver(post_save, sender=Newsletter)
+@receiver(post_delete, sender=Newsletter)
+def newsletter_schedule_changed(sender, instance, **kwargs):
+    """Перепланирование запуска рассылки в планировщиках при ее изменении или удалении"""
+    notify_schedule_changed(instance.pk)
+
+
+@receiver(pre_save, sender=Newsletter)
+def remember_newsletter_activity(sender, instance, **kwargs):
+    """Активность рассылки до сохранения, чтобы учесть ее изменение в счетчиках главной страницы"""
+    instance._saved_is_active = None if instance._state.adding else \
+        Newsletter.objects.filter(pk=instance.pk).values_list('is_active', flat=True).first()
+
+
+@receiver(post_save, sender=Newsletter)
+def count_newsletter(sender, instance, created, **kwargs):
+    """Учет новой рассылки и изменения ее активности в счетчиках главной страницы"""
+    if created:
+        change_dashboard_counters(newsletters=1, active_newsletters=int(instance.is_active))
+    elif instance._saved_is_active is not None and instance._saved_is_active != instance.is_active:
+        change_dashboard_counters(active_newsletters=1 if instance.is_active else -1)
+
+
+@receiver(post_delete, sender=Newsletter)
+def uncount_newsletter(sender, instance, origin=None, **kwargs):
+    """Учет удаленных рассылок в счетчиках главной страницы, один раз на удаление"""
+    defer_to_commit(instance if origin is None else origin, '_deleted_newsletters', instance.is_active,
+                    newsletters_deleted)
+
+
+@receiver(pre_save, sender=Client)
+def remember_client_email(sender, instance, **kwargs):
+    """Адрес клиента до сохранения, чтобы учесть его изменение в счетчиках главной страницы"""
+    instance._saved_email = None if instance._state.adding else \
+        Client.objects.filter(pk=instance.pk).values_list('email', flat=True).first()
+
+
+@receiver(post_save, sender=Client)
+def count_client(sender, instance, created, **kwargs):
+    """Учет нового клиента и изменения его адреса в числе уникальных адресов"""
+    if created or instance._saved_email is None:
+        client_added(instance.email)
+    elif instance._saved_email != instance.email:
+        clients_removed([instance._saved_email])
+        client_added(instance.email)
+
+
+@receiver(post_delete, sender=Client)
+def uncount_client(sender, instance, origin=None, **kwargs):
+    """Учет удаленных клиентов в числе уникальных адресов, один раз на удаление"""
+    defer_to_commit(instance if origin is None else origin, '_deleted_client_emails', instance.email, clients_removed)
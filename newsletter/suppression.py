@@ -0,0 +1,157 @@
+import hashlib
+import math
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+
+from newsletter.caching import CacheLock
+from newsletter.links import get_site_url_format
+from newsletter.models import Suppression, normalize_email
+from newsletter.queues import CacheQueue
+
+SUPPRESSION_FILTER_KEY = 'suppression_filter'
+UNSUBSCRIBE_SALT = 'newsletter.unsubscribe'
+SUPPRESSION_LOCK_TIMEOUT = 120  # Сколько секунд фильтр может строиться, прежде чем его начнет строить другой процесс
+SUPPRESSION_ERROR_RATE = 0.001  # Доля адресов, которые фильтр ошибочно считает исключенными (их проверяет БД)
+
+# Отписки посетителей, еще не перенесенные в список исключений
+unsubscribe_queue = CacheQueue('unsubscribe_queue')
+
+
+class BloomFilter:
+    """Фильтр Блума: проверка принадлежности множеству за O(1) в компактном битовом массиве.
+
+    Элемент, который был добавлен, всегда найдется; отсутствующий найдется с вероятностью около error_rate.
+    Для миллиона адресов массив занимает около 1,8 МБ. Удалить элемент нельзя, фильтр перестраивается целиком.
+    """
+
+    def __init__(self, capacity, error_rate=SUPPRESSION_ERROR_RATE):
+        capacity = max(capacity, 1000)
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Двойное хеширование: k позиций из двух половин одного хеша
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def build_suppression_filter():
+    """Построение фильтра по всем исключенным адресам; возвращает (время построения, фильтр)"""
+    built_at = timezone.now()
+    suppressions = Suppression.objects.filter(created_at__lt=built_at)
+    bloom = BloomFilter(suppressions.count())
+    for email in suppressions.values_list('email', flat=True).iterator(
+            chunk_size=settings.NEWSLETTER_RECIPIENT_CHUNK_SIZE):
+        bloom.add(email)
+    return built_at, bloom
+
+
+_suppression_filter = None
+
+
+def get_suppression_filter():
+    """Фильтр исключенных адресов и время его построения.
+
+    Фильтр строится одним процессом, хранится в кеше и в памяти процессов и перестраивается не чаще раза
+    в NEWSLETTER_SUPPRESSION_REBUILD_SECONDS: адреса, добавленные после построения, проверяет SuppressionChecker.
+    """
+    global _suppression_filter
+    max_age = settings.NEWSLETTER_SUPPRESSION_REBUILD_SECONDS
+    now = timezone.now()
+    if _suppression_filter is None or (now - _suppression_filter[0]).total_seconds() > max_age:
+        cached = cache.get(SUPPRESSION_FILTER_KEY)
+        if cached is None or (now - cached[0]).total_seconds() > max_age:
+            cached = rebuild_suppression_filter(cached or _suppression_filter)
+        _suppression_filter = cached
+    return _suppression_filter
+
+
+def rebuild_suppression_filter(stale):
+    """Перестроение фильтра процессом, захватившим блокировку.
+
+    Остальные процессы в это время пользуются устаревшим фильтром stale: адреса, добавленные после его построения,
+    SuppressionChecker все равно проверяет по БД. Фильтра нет совсем только при первом запуске - тогда его
+    построение ожидается, но не дольше SUPPRESSION_LOCK_TIMEOUT.
+    """
+    lock = CacheLock(SUPPRESSION_FILTER_KEY, SUPPRESSION_LOCK_TIMEOUT)
+    acquired, stale = lock.acquire_or_wait(stale, lambda: cache.get(SUPPRESSION_FILTER_KEY), SUPPRESSION_LOCK_TIMEOUT)
+    if not acquired:
+        return build_suppression_filter() if stale is None else stale
+    try:
+        built = build_suppression_filter()
+        cache.set(SUPPRESSION_FILTER_KEY, built, timeout=None)
+    finally:
+        lock.release()
+    return built
+
+
+def get_unsubscribe_token(email):
+    """Подписанный токен отписки адреса; проверяется без обращения к БД"""
+    return signing.Signer(salt=UNSUBSCRIBE_SALT).sign_object(normalize_email(email))
+
+
+def get_unsubscribe_email(token):
+    """Адрес из токена отписки или None, если подпись неверна"""
+    try:
+        return signing.Signer(salt=UNSUBSCRIBE_SALT).unsign_object(token)
+    except signing.BadSignature:
+        return None
+
+
+def get_unsubscribe_url(email):
+    """Ссылка отписки для письма получателю"""
+    return get_site_url_format('newsletter:unsubscribe').format(token=get_unsubscribe_token(email))
+
+
+def enqueue_unsubscribe(email):
+    """Постановка отписки в очередь в кеше, без записи в БД"""
+    unsubscribe_queue.push(email)
+
+
+def flush_unsubscribes(limit=1000):
+    """Перенос отписок из очереди в список исключений пачками по limit; возвращает количество перенесенных.
+
+    Вызывается вне транзакции: очередь продвигается сразу после записи пачки, и откат транзакции потерял бы отписки.
+    """
+    return unsubscribe_queue.consume(lambda emails: Suppression.objects.bulk_create(
+        [Suppression(email=normalize_email(email), reason=Suppression.Reason.UNSUBSCRIBED) for email in emails],
+        ignore_conflicts=True), limit)
+
+
+class SuppressionChecker:
+    """Исключение подавленных адресов из потока получателей.
+
+    Адрес проверяется по фильтру Блума и по множеству адресов, добавленных после его построения (одно чтение
+    из БД на проход). Совпадения пачки подтверждаются одним запросом к БД, поэтому ложные срабатывания фильтра
+    и адреса, удаленные из списка, не теряют писем, а на адрес вне списка приходится только вычисление хеша.
+    """
+
+    def __init__(self):
+        built_at, self.bloom = get_suppression_filter()
+        self.recent = set(Suppression.objects.filter(created_at__gte=built_at).values_list('email', flat=True))
+        self.suppressed = 0
+
+    def filter(self, recipients):
+        """Получатели (адрес, имя) пачки без исключенных адресов"""
+        candidates = {email: normalize_email(email) for email, fullname in recipients}
+        candidates = {email: normalized for email, normalized in candidates.items()
+                      if normalized in self.recent or normalized in self.bloom}
+        if not candidates:
+            return recipients
+        suppressed = set(Suppression.objects.filter(email__in=candidates.values()).values_list('email', flat=True))
+        kept = [recipient for recipient in recipients if candidates.get(recipient[0]) not in suppressed]
+        self.suppressed += len(recipients) - len(kept)
+        return kept
+
@@ -1,3 +1,787 @@
-from django.test import TestCase
+import argparse
+import datetime
+import email
+import email.policy
+import os
+import smtplib
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends import locmem
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from newsletter import bounces, suppression
+from newsletter.bounces import parse_bounce, process_maildir, process_mbox
+from newsletter.caching import CacheLock, cached
+from newsletter.checks import check_site_url
+from newsletter.dashboard import get_dashboard_counters, reconcile_dashboard_counters
+from newsletter.links import get_site_url_format
+from newsletter.management.commands.run_newsletter import parse_shard
+from newsletter.metrics import get_concurrency_window, set_concurrency_window
+from newsletter.models import (BounceCheckpoint, Client, Delivery, Log, Message, Newsletter, OutboxTask,
+                               ProcessedBounce, Suppression, TransactionalMail)
+from newsletter.queues import CacheQueue
+from newsletter.services import (AdaptiveConcurrency, PreparedEmailMessage, PreparedMessage, RateLimiter,
+                                 RateLimitExceeded, SMTPConnectionPool, SendInterrupted, claim_outbox_tasks, fail_task,
+                                 schedule_due_newsletters, send_task, send_transactional_mail,
+                                 send_transactional_outbox, write_outbox)
+from newsletter.suppression import BloomFilter, SuppressionChecker, get_suppression_filter
+from newsletter.tracking import get_open_url
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class RefusingEmailBackend(locmem.EmailBackend):
+    """Почтовый бэкенд тестов: адресу busy@ отвечает временной ошибкой 451, адресу unknown@ - постоянной 550"""
+
+    def send_messages(self, messages):
+        for message in messages:
+            mailbox = message.to[0].split('@')[0]
+            if mailbox == 'busy':
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (451, b'Try again later')})
+            if mailbox == 'unknown':
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+def make_dsn(*recipients, message_id='<dsn@example.com>'):
+    """Уведомление о недоставке в формате DSN (RFC 3464) с полями (адрес, Action, Status) для каждого получателя"""
+    fields = ''.join(f'\nFinal-Recipient: rfc822; {address}\nAction: {action}\nStatus: {status}\n'
+                     for address, action, status in recipients)
+    return (f'From: MAILER-DAEMON@example.com\nTo: noreply@example.com\nSubject: Undelivered Mail\n'
+            f'Message-ID: {message_id}\nMIME-Version: 1.0\n'
+            f'Content-Type: multipart/report; report-type=delivery-status; boundary="B"\n\n'
+            f'--B\nContent-Type: text/plain\n\nDelivery failed.\n\n'
+            f'--B\nContent-Type: message/delivery-status\n\nReporting-MTA: dns; mx.example.com\n{fields}\n'
+            f'--B--\n').encode()
+
+
+def parse_message(data):
+    return email.message_from_bytes(data, policy=email.policy.default)
+
+
+def run_task(task):
+    """Отправка задачи в текущем потоке, без закрытия соединения с БД внутри транзакции теста"""
+    send_task.__wrapped__(OutboxTask.objects.select_related('newsletter__message').get(pk=task.pk),
+                          SMTPConnectionPool())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMAIL_HOST_USER='noreply@example.com', NEWSLETTER_UNSUBSCRIBE_LINKS=False,
+                   NEWSLETTER_TRACKING=False)
+class SendTaskTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        message = Message.objects.create(subject='Новости', content='Здравствуйте, {{ fullname }}!')
+        self.newsletter = Newsletter.objects.create(name='Новости', start_date=datetime.date.today(),
+                                                    message=message, status=Newsletter.Status.RUNNING)
+
+    def create_task(self, recipients):
+        log = Log.objects.create(newsletter=self.newsletter, status=Log.STATUS_LOG[2][0],
+                                 total_count=len(recipients), started_at=timezone.now())
+        return OutboxTask.objects.create(log=log, newsletter=self.newsletter, next_attempt_at=timezone.now(),
+                                         recipients=[[address, address.split('@')[0]] for address in recipients])
+
+    def get_statuses(self, task):
+        return dict(Delivery.objects.filter(log_id=task.log_id).values_list('email', 'status'))
+
+    def test_resumed_task_is_not_resent(self):
+        task = self.create_task(['sending@example.com', 'sent@example.com', 'new@example.com'])
+        Delivery.objects.create(log_id=task.log_id, newsletter=self.newsletter, email='sending@example.com',
+                                status=Delivery.Status.SENDING, datetime=timezone.now())
+        Delivery.objects.create(log_id=task.log_id, newsletter=self.newsletter, email='sent@example.com',
+                                status=Delivery.Status.SENT, datetime=timezone.now())
+
+        run_task(task)
+
+        self.assertEqual([message.to for message in mail.outbox], [['new@example.com']])
+        self.assertEqual(self.get_statuses(task), {'sending@example.com': Delivery.Status.FAILED,
+                                                   'sent@example.com': Delivery.Status.SENT,
+                                                   'new@example.com': Delivery.Status.SENT})
+        self.assertEqual(Delivery.objects.get(email='sending@example.com').error,
+                         str(SendInterrupted('Отправка прервана, письмо могло быть доставлено')))
+        log = Log.objects.get(pk=task.log_id)
+        self.assertEqual((log.sent_count, log.failed_count), (2, 1))
+        self.assertFalse(OutboxTask.objects.exists())
+
+    @override_settings(EMAIL_BACKEND='newsletter.tests.RefusingEmailBackend', NEWSLETTER_RETRY_MAX_ATTEMPTS=2)
+    def test_transient_errors_are_retried(self):
+        task = self.create_task(['ok@example.com', 'busy@example.com', 'unknown@example.com'])
+
+        run_task(task)
+
+        retry = OutboxTask.objects.get()
+        self.assertEqual(retry.recipients, [['busy@example.com', 'busy']])
+        self.assertEqual(retry.attempts, 1)
+        self.assertIn('Try again later', retry.last_error)
+        self.assertGreater(retry.next_attempt_at, timezone.now())
+        self.assertEqual(self.get_statuses(task), {'ok@example.com': Delivery.Status.SENT,
+                                                   'busy@example.com': Delivery.Status.DEFERRED,
+                                                   'unknown@example.com': Delivery.Status.FAILED})
+        self.assertEqual(Log.objects.get().status, Log.STATUS_LOG[2][0])
+        self.assertEqual(Newsletter.objects.get().status, Newsletter.Status.RUNNING)
+
+        run_task(retry)
+
+        self.assertFalse(OutboxTask.objects.exists())
+        self.assertEqual(self.get_statuses(task)['busy@example.com'], Delivery.Status.FAILED)
+        log = Log.objects.get(pk=task.log_id)
+        self.assertEqual((log.sent_count, log.failed_count), (1, 2))
+        self.assertEqual(log.sent_count + log.failed_count, log.total_count)
+        self.assertEqual(log.status, Log.STATUS_LOG[0][0])
+        self.assertIsNotNone(log.finished_at)
+        self.assertEqual(Newsletter.objects.get().status, Newsletter.Status.CREATED)
+        self.assertEqual([message.to for message in mail.outbox], [['ok@example.com']])
+
+    def test_duplicate_clients_are_written_once(self):
+        for fullname in ('Иван', 'Иван Петров'):
+            self.newsletter.clients.add(Client.objects.create(email='ivan@example.com', fullname=fullname))
+        self.newsletter.clients.add(Client.objects.create(email='anna@example.com', fullname='Анна'))
+        log = Log.objects.create(newsletter=self.newsletter, status=Log.STATUS_LOG[2][0], started_at=timezone.now())
+
+        self.assertEqual(write_outbox(self.newsletter, log, timezone.now()), (2, 0))
+        self.assertEqual(sorted(email for email, fullname in OutboxTask.objects.get().recipients),
+                         ['anna@example.com', 'ivan@example.com'])
+
+    @override_settings(EMAIL_BACKEND='newsletter.tests.RefusingEmailBackend')
+    def test_duplicate_recipients_are_sent_once(self):
+        task = self.create_task(['unknown@example.com', 'ok@example.com', 'unknown@example.com', 'ok@example.com'])
+
+        run_task(task)
+
+        self.assertEqual([message.to for message in mail.outbox], [['ok@example.com']])
+        self.assertEqual(self.get_statuses(task), {'ok@example.com': Delivery.Status.SENT,
+                                                   'unknown@example.com': Delivery.Status.FAILED})
+        self.assertIn('No such user', Delivery.objects.get(email='unknown@example.com').error)
+        log = Log.objects.get(pk=task.log_id)
+        self.assertEqual((log.sent_count, log.failed_count, log.total_count), (1, 1, 2))
+        self.assertEqual(Newsletter.objects.get().status, Newsletter.Status.CREATED)
+
+    @override_settings(NEWSLETTER_RETRY_MAX_ATTEMPTS=1)
+    def test_failed_task_with_duplicate_recipients_is_finished(self):
+        task = self.create_task(['sent@example.com', 'new@example.com', 'new@example.com'])
+        Delivery.objects.create(log_id=task.log_id, newsletter=self.newsletter, email='sent@example.com',
+                                status=Delivery.Status.SENT, datetime=timezone.now())
+
+        fail_task(task, ConnectionError('Connection refused'))
+
+        self.assertFalse(OutboxTask.objects.exists())
+        self.assertEqual(self.get_statuses(task), {'sent@example.com': Delivery.Status.SENT,
+                                                   'new@example.com': Delivery.Status.FAILED})
+        log = Log.objects.get(pk=task.log_id)
+        self.assertEqual((log.sent_count, log.failed_count, log.total_count), (1, 1, 2))
+        self.assertEqual(Newsletter.objects.get().status, Newsletter.Status.CREATED)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SITE_URL='https://newsletter.example.com')
+class PreparedEmailMessageTestCase(SimpleTestCase):
+    def parse(self, prepared, to='ivan@example.com', fullname='Иван'):
+        data = PreparedEmailMessage(prepared, to, fullname).message().as_bytes()
+        return email.message_from_bytes(data, policy=email.policy.default)
+
+    def test_plain_message(self):
+        parsed = self.parse(PreparedMessage('Новости недели', 'Текст письма', 'noreply@example.com'))
+
+        self.assertEqual(parsed['Subject'], 'Новости недели')
+        self.assertEqual(parsed['From'], 'noreply@example.com')
+        self.assertEqual(parsed['To'], 'ivan@example.com')
+        self.assertIsNotNone(parsed['Date'])
+        self.assertIsNotNone(parsed['Message-ID'])
+        self.assertIsNone(parsed['List-Unsubscribe'])
+        self.assertEqual(parsed.get_content_type(), 'text/plain')
+        self.assertEqual(parsed.get_content().strip(), 'Текст письма')
+
+    def test_messages_have_own_headers(self):
+        prepared = PreparedMessage('Новости', 'Текст', 'noreply@example.com')
+        first, second = self.parse(prepared, 'first@example.com'), self.parse(prepared, 'second@example.com')
+
+        self.assertEqual((first['To'], second['To']), ('first@example.com', 'second@example.com'))
+        self.assertNotEqual(first['Message-ID'], second['Message-ID'])
+
+    def test_personalized_message(self):
+        parsed = self.parse(PreparedMessage('Новости', 'Здравствуйте, {{ fullname }} <{{ email }}>!',
+                                            'noreply@example.com'))
+
+        self.assertEqual(parsed['To'], 'ivan@example.com')
+        self.assertEqual(parsed.get_content().strip(), 'Здравствуйте, Иван <ivan@example.com>!')
+
+    def test_unsubscribe_link(self):
+        parsed = self.parse(PreparedMessage('Новости', 'Текст', 'noreply@example.com', unsubscribe=True))
+
+        url = parsed['List-Unsubscribe'].strip('<>')
+        self.assertTrue(url.startswith('https://newsletter.example.com/'))
+        self.assertEqual(parsed['List-Unsubscribe-Post'], 'List-Unsubscribe=One-Click')
+        self.assertIn(url, parsed.get_content())
+
+    def test_tracked_message(self):
+        parsed = self.parse(PreparedMessage('Новости', 'Подробнее: https://example.com/article, {{ fullname }}',
+                                            'noreply@example.com', newsletter_id=7))
+
+        self.assertEqual(parsed.get_content_type(), 'multipart/alternative')
+        self.assertEqual(parsed['To'], 'ivan@example.com')
+        text = parsed.get_body(('plain',)).get_content()
+        html = parsed.get_body(('html',)).get_content()
+        self.assertIn('Иван', text)
+        self.assertNotIn('https://example.com/article', text)
+        self.assertIn('https://newsletter.example.com/', text)
+        self.assertIn(get_open_url(7), html)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheQueueTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.queue = CacheQueue('test_queue')
+        self.consumed = []
+
+    def consume(self):
+        return self.queue.consume(self.consumed.extend)
+
+    def reserve_index(self):
+        """Номер, выданный процессом, который упал до записи элемента"""
+        return cache.incr('test_queue:tail')
+
+    def test_items_are_consumed_once(self):
+        for item in ('a', 'b', 'c'):
+            self.queue.push(item)
+
+        self.assertEqual(self.consume(), 3)
+        self.assertEqual(self.consume(), 0)
+        self.assertEqual(self.consumed, ['a', 'b', 'c'])
+
+    def test_consume_in_batches(self):
+        for item in range(5):
+            self.queue.push(item)
+
+        self.assertEqual(self.queue.consume(self.consumed.extend, limit=2), 5)
+        self.assertEqual(self.consumed, [0, 1, 2, 3, 4])
+
+    def test_gap_is_waited_for_once(self):
+        self.queue.push('a')
+        index = self.reserve_index()
+        self.queue.push('c')
+
+        self.assertEqual(self.consume(), 1)
+        self.assertEqual(self.consumed, ['a'])
+
+        cache.set(f'test_queue:{index}', 'b', timeout=None)
+        self.assertEqual(self.consume(), 2)
+        self.assertEqual(self.consumed, ['a', 'b', 'c'])
+
+    def test_gap_is_skipped_on_next_consume(self):
+        self.queue.push('a')
+        self.reserve_index()
+        self.queue.push('c')
+
+        self.assertEqual(self.consume(), 1)
+        self.assertEqual(self.consume(), 1)
+        self.assertEqual(self.consumed, ['a', 'c'])
+        self.assertEqual(self.consume(), 0)
+
+    def test_locked_queue_is_not_consumed(self):
+        self.queue.push('a')
+        cache.add('test_queue:lock', 1)
+
+        self.assertEqual(self.consume(), 0)
+        cache.delete('test_queue:lock')
+        self.assertEqual(self.consume(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, NEWSLETTER_METRICS_TOKEN='secret')
+class MetricsViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_access_is_forbidden(self):
+        self.assertEqual(self.client.get(reverse('newsletter:metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('newsletter:metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code,
+                         403)
+
+    @override_settings(NEWSLETTER_METRICS_TOKEN=None)
+    def test_no_token_is_forbidden_without_staff(self):
+        self.client.force_login(get_user_model().objects.create(email='user@example.com'))
+
+        self.assertEqual(self.client.get(reverse('newsletter:metrics')).status_code, 403)
+
+    def test_token_access(self):
+        response = self.client.get(reverse('newsletter:metrics'), HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'newsletter_outbox_tasks', response.content)
+
+    @override_settings(NEWSLETTER_METRICS_TOKEN=None)
+    def test_staff_access(self):
+        self.client.force_login(get_user_model().objects.create(email='staff@example.com', is_staff=True))
+
+        self.assertEqual(self.client.get(reverse('newsletter:metrics')).status_code, 200)
+
+
+class SiteUrlCheckTestCase(SimpleTestCase):
+    @override_settings(SITE_URL=None, NEWSLETTER_UNSUBSCRIBE_LINKS=True, NEWSLETTER_TRACKING=False)
+    def test_links_require_site_url(self):
+        self.assertEqual([error.obj for error in check_site_url(None)], ['NEWSLETTER_UNSUBSCRIBE_LINKS'])
+
+    @override_settings(SITE_URL=None, NEWSLETTER_UNSUBSCRIBE_LINKS=False, NEWSLETTER_TRACKING=False)
+    def test_no_links_without_site_url(self):
+        self.assertEqual(check_site_url(None), [])
+
+    @override_settings(SITE_URL='https://newsletter.example.com', NEWSLETTER_UNSUBSCRIBE_LINKS=True,
+                       NEWSLETTER_TRACKING=True)
+    def test_links_with_site_url(self):
+        self.assertEqual(check_site_url(None), [])
+
+    @override_settings(SITE_URL=None)
+    def test_link_format_requires_site_url(self):
+        get_site_url_format.cache_clear()
+        self.addCleanup(get_site_url_format.cache_clear)
+
+        with self.assertRaises(ImproperlyConfigured):
+            get_site_url_format('newsletter:unsubscribe')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, NEWSLETTER_SUPPRESSION_REBUILD_SECONDS=60)
+class SuppressionFilterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        suppression._suppression_filter = None
+        self.stale = (timezone.now() - datetime.timedelta(hours=1), BloomFilter(0))
+        cache.set(suppression.SUPPRESSION_FILTER_KEY, self.stale, timeout=None)
+        Suppression.objects.create(email='unsubscribed@example.com')
+
+    def tearDown(self):
+        suppression._suppression_filter = None
+
+    def test_stale_filter_is_rebuilt(self):
+        built_at, bloom = get_suppression_filter()
+
+        self.assertGreater(built_at, self.stale[0])
+        self.assertIn('unsubscribed@example.com', bloom)
+        self.assertEqual(cache.get(suppression.SUPPRESSION_FILTER_KEY)[0], built_at)
+        self.assertIsNone(cache.get(f'{suppression.SUPPRESSION_FILTER_KEY}:lock'))
+
+    def test_stale_filter_is_used_while_another_process_rebuilds_it(self):
+        cache.add(f'{suppression.SUPPRESSION_FILTER_KEY}:lock', 1)
+
+        self.assertEqual(get_suppression_filter()[0], self.stale[0])
+        checker = SuppressionChecker()
+        self.assertEqual(checker.filter([('unsubscribed@example.com', 'A'), ('client@example.com', 'B')]),
+                         [('client@example.com', 'B')])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMAIL_HOST_USER='noreply@example.com',
+                   EMAIL_RATE_LIMITS={'noreply@example.com': {'minute': 1}})
+class TransactionalMailTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_mail_is_deferred_without_waiting_for_limit(self):
+        send_transactional_mail('Сброс пароля', 'Новый пароль', ['first@example.com'])
+        send_transactional_mail('Сброс пароля', 'Новый пароль', ['second@example.com'])
+
+        self.assertEqual([message.to for message in mail.outbox], [['first@example.com']])
+        deferred = TransactionalMail.objects.get()
+        self.assertEqual(deferred.recipients, ['second@example.com'])
+        self.assertGreater(deferred.next_attempt_at, timezone.now())
+        self.assertEqual(send_transactional_outbox(), 0)
+
+        cache.clear()
+        TransactionalMail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(send_transactional_outbox(), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['first@example.com'], ['second@example.com']])
+        self.assertFalse(TransactionalMail.objects.exists())
+
+    def test_deferred_mail_waits_for_limit(self):
+        send_transactional_mail('Сброс пароля', 'Новый пароль', ['first@example.com'])
+        TransactionalMail.objects.create(subject='Сброс пароля', message='Новый пароль',
+                                         recipients=['second@example.com'], next_attempt_at=timezone.now())
+
+        self.assertEqual(send_transactional_outbox(), 0)
+        self.assertGreater(TransactionalMail.objects.get().next_attempt_at, timezone.now())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(NEWSLETTER_SOFT_BOUNCE_LIMIT=2)
+class BouncesTestCase(TestCase):
+    def setUp(self):
+        for address in ('hard@example.com', 'soft@example.com', 'later@example.com'):
+            Client.objects.create(email=address, fullname=address.split('@')[0])
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def get_deliverability(self):
+        return dict(Client.objects.values_list('email', 'deliverability'))
+
+    def write_mbox(self, name, *messages):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'ab') as file:
+            for data in messages:
+                file.write(b'From MAILER-DAEMON Thu Jan  1 00:00:00 2026\n' + data + b'\n')
+        return path
+
+    def make_maildir(self, *messages):
+        for folder in ('new', 'cur', 'tmp'):
+            os.mkdir(os.path.join(self.directory.name, folder))
+        for index, data in enumerate(messages):
+            with open(os.path.join(self.directory.name, 'new', f'{index}.bounce'), 'wb') as file:
+                file.write(data)
+        return self.directory.name
+
+    def test_dsn_classification(self):
+        message = parse_message(make_dsn(('hard@example.com', 'failed', '5.1.1'),
+                                         ('soft@example.com', 'failed', '4.2.2'),
+                                         ('later@example.com', 'delayed', '4.4.1')))
+
+        self.assertEqual(parse_bounce(message), [('hard@example.com', True, '5.1.1'),
+                                                 ('soft@example.com', False, '4.2.2')])
+
+    def test_failed_recipients_header(self):
+        message = parse_message(b'From: MAILER-DAEMON@example.com\nX-Failed-Recipients: hard@example.com, '
+                                b'soft@example.com\nSubject: Undelivered Mail\n\n'
+                                b'550 5.1.1 The email account does not exist\n')
+
+        self.assertEqual(parse_bounce(message), [('hard@example.com', True, '5.1.1'),
+                                                 ('soft@example.com', True, '5.1.1')])
+
+    def test_mbox_checkpoint_is_resumed(self):
+        path = self.write_mbox('bounces', make_dsn(('hard@example.com', 'failed', '5.1.1')))
+        self.assertEqual(list(process_mbox(path, 100)), [(1, 1, 0)])
+
+        self.write_mbox('bounces', make_dsn(('soft@example.com', 'failed', '4.2.2')))
+        self.assertEqual(list(process_mbox(path, 100)), [(1, 0, 1)])
+        self.assertEqual(list(process_mbox(path, 100)), [])
+        self.assertEqual(BounceCheckpoint.objects.get().position, os.path.getsize(path))
+        self.assertEqual(self.get_deliverability()['soft@example.com'], Client.Deliverability.SOFT_BOUNCE)
+
+    def test_rotated_mbox_is_read_from_start(self):
+        path = self.write_mbox('bounces', make_dsn(('hard@example.com', 'failed', '5.1.1')),
+                               make_dsn(('later@example.com', 'failed', '5.1.1')))
+        list(process_mbox(path, 100))
+
+        rotated = self.write_mbox('rotated', make_dsn(('soft@example.com', 'failed', '4.2.2')))
+        os.replace(rotated, path)
+
+        self.assertEqual(list(process_mbox(path, 100)), [(1, 0, 1)])
+        self.assertEqual(BounceCheckpoint.objects.get().inode, os.stat(path).st_ino)
+
+    def test_malformed_message_is_skipped(self):
+        path = self.make_maildir(make_dsn(('hard@example.com', 'failed', '5.1.1')), b'Subject: broken\n\n')
+
+        with mock.patch.object(bounces, 'parse_bounce', side_effect=[[('hard@example.com', True, '5.1.1')],
+                                                                     AttributeError('broken')]):
+            self.assertEqual(list(process_maildir(path, 100)), [(2, 1, 0)])
+        self.assertEqual(self.get_deliverability()['hard@example.com'], Client.Deliverability.HARD_BOUNCE)
+        self.assertEqual(os.listdir(os.path.join(path, 'new')), [])
+
+    def test_maildir_is_not_counted_twice_after_crash(self):
+        path = self.make_maildir(make_dsn(('soft@example.com', 'failed', '4.2.2')))
+
+        with mock.patch.object(os, 'rename', side_effect=OSError('crash')), self.assertRaises(OSError):
+            list(process_maildir(path, 100))
+        self.assertEqual(list(process_maildir(path, 100)), [(0, 0, 0)])
+
+        self.assertEqual(Client.objects.get(email='soft@example.com').soft_bounces, 1)
+        self.assertFalse(Suppression.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(path, 'cur')), ['0.bounce:2,S'])
+        self.assertFalse(ProcessedBounce.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheLockTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.lock = CacheLock('test', timeout=60)
+
+    def test_lock_is_exclusive(self):
+        self.assertTrue(self.lock.acquire())
+        self.assertFalse(CacheLock('test', timeout=60).acquire())
+        self.lock.release()
+        self.assertTrue(CacheLock('test', timeout=60).acquire())
+
+    def test_value_saved_by_owner_is_waited_for(self):
+        self.lock.acquire()
+        values = iter([None, 'value'])
+
+        self.assertEqual(CacheLock('test', timeout=60).acquire_or_wait(None, lambda: next(values), timeout=1),
+                         (False, 'value'))
+
+    def test_wait_is_bounded_by_timeout(self):
+        self.lock.acquire()
+
+        self.assertEqual(CacheLock('test', timeout=60).acquire_or_wait(None, lambda: None, timeout=0.1), (False, None))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CACHE_ENABLED=True)
+class CachedFunctionTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+        self.function = cached('test_function', timeout=60, lock_timeout=0.2)(self.compute)
+
+    def compute(self, argument):
+        self.calls.append(argument)
+        return f'{argument}:{len(self.calls)}'
+
+    def expire(self, argument):
+        key = self.function.get_key([argument])
+        value, fresh_until, generation = cache.get(key)
+        cache.set(key, (value, time.time() - 1, generation))
+        return key
+
+    def test_fresh_value_is_cached(self):
+        self.assertEqual(self.function('a'), 'a:1')
+        self.assertEqual(self.function('a'), 'a:1')
+        self.assertEqual(self.function('b'), 'b:2')
+        self.assertEqual(self.calls, ['a', 'b'])
+
+    def test_stale_value_is_recomputed(self):
+        self.function('a')
+        self.expire('a')
+
+        self.assertEqual(self.function('a'), 'a:2')
+        self.assertEqual(self.function('a'), 'a:2')
+
+    def test_stale_value_is_served_while_another_process_recomputes(self):
+        self.function('a')
+        key = self.expire('a')
+        cache.add(f'{key}:lock', 1)
+
+        self.assertEqual(self.function('a'), 'a:1')
+        self.assertEqual(self.calls, ['a'])
+
+    def test_missing_value_is_computed_after_lock_timeout(self):
+        cache.add(f'{self.function.get_key(["a"])}:lock', 1)
+
+        self.assertEqual(self.function('a'), 'a:1')
+        self.assertIsNone(cache.get(self.function.get_key(['a'])))
+
+    def test_invalidate(self):
+        self.function('a')
+        self.function.invalidate()
+
+        self.assertEqual(self.function('a'), 'a:2')
+        self.assertEqual(self.function('a'), 'a:2')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DashboardCountersTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        reconcile_dashboard_counters()
+        self.message = Message.objects.create(subject='Новости', content='Текст')
+
+    def create_newsletter(self, is_active=True):
+        return Newsletter.objects.create(name='Новости', start_date=datetime.date.today(), message=self.message,
+                                         is_active=is_active)
+
+    def test_newsletter_counters(self):
+        self.create_newsletter()
+        inactive = self.create_newsletter(is_active=False)
+        self.assertEqual(get_dashboard_counters(), {'newsletters': 2, 'active_newsletters': 1, 'client_emails': 0})
+
+        inactive.is_active = True
+        inactive.save()
+        self.assertEqual(get_dashboard_counters()['active_newsletters'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Newsletter.objects.all().delete()
+        self.assertEqual(get_dashboard_counters(), {'newsletters': 0, 'active_newsletters': 0, 'client_emails': 0})
+        self.assertEqual(reconcile_dashboard_counters(), {})
+
+    def test_client_email_counters(self):
+        Client.objects.create(email='ivan@example.com', fullname='Иван')
+        duplicate = Client.objects.create(email='ivan@example.com', fullname='Иван Петров')
+        Client.objects.create(email='anna@example.com', fullname='Анна')
+        self.assertEqual(get_dashboard_counters()['client_emails'], 2)
+
+        duplicate.email = 'petrov@example.com'
+        duplicate.save()
+        self.assertEqual(get_dashboard_counters()['client_emails'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Client.objects.exclude(email='anna@example.com').delete()
+        self.assertEqual(get_dashboard_counters()['client_emails'], 1)
+        self.assertEqual(reconcile_dashboard_counters(), {})
+
+    def test_reconcile_fixes_bulk_changes(self):
+        Client.objects.bulk_create([Client(email='ivan@example.com', fullname='Иван'),
+                                    Client(email='anna@example.com', fullname='Анна')])
+
+        self.assertEqual(reconcile_dashboard_counters(), {'client_emails': 2})
+        self.assertEqual(get_dashboard_counters()['client_emails'], 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, NEWSLETTER_MAX_LAG=0)
+class ScheduleDueNewslettersTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.message = Message.objects.create(subject='Новости', content='Текст')
+        self.recipient = Client.objects.create(email='ivan@example.com', fullname='Иван')
+
+    def create_newsletter(self, run_at):
+        newsletter = Newsletter.objects.create(name='Новости', start_date=run_at.date(), time=run_at.time(),
+                                               message=self.message)
+        newsletter.clients.add(self.recipient)
+        return newsletter
+
+    @override_settings(NEWSLETTER_CATCHUP_BATCH=2)
+    def test_overdue_newsletters_are_caught_up(self):
+        run_at = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=3)
+        newsletters = [self.create_newsletter(run_at) for _ in range(3)]
+
+        self.assertEqual(len(schedule_due_newsletters(timezone.now())), 3)
+
+        self.assertEqual(OutboxTask.objects.count(), 3)
+        for log in Log.objects.all():
+            self.assertEqual((log.scheduled_for, log.missed_runs, log.total_count), (run_at, 3, 1))
+            self.assertEqual(log.status, Log.STATUS_LOG[2][0])
+        for newsletter in Newsletter.objects.filter(pk__in=[newsletter.pk for newsletter in newsletters]):
+            self.assertEqual(newsletter.status, Newsletter.Status.RUNNING)
+            self.assertEqual(newsletter.start_date, run_at.date() + datetime.timedelta(days=4))
+        self.assertEqual(schedule_due_newsletters(timezone.now()), [])
+
+    def test_late_newsletter_is_skipped(self):
+        late = self.create_newsletter(timezone.localtime() - datetime.timedelta(hours=2))
+        due = self.create_newsletter(timezone.localtime() - datetime.timedelta(seconds=30))
+
+        self.assertEqual(schedule_due_newsletters(timezone.now(), max_lag=600), [due])
+
+        skipped_log = Log.objects.get(newsletter=late)
+        self.assertEqual(skipped_log.status, Log.STATUS_LOG[1][0])
+        self.assertIsNotNone(skipped_log.finished_at)
+        self.assertIn('Запуск пропущен', skipped_log.server_response)
+        self.assertFalse(OutboxTask.objects.filter(newsletter=late).exists())
+        late.refresh_from_db()
+        self.assertEqual(late.status, Newsletter.Status.CREATED)
+        self.assertGreater(late.next_run_at, timezone.now())
+        self.assertEqual(OutboxTask.objects.get().newsletter, due)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RateLimiterTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_limit_per_window(self):
+        limiter = RateLimiter('noreply@example.com', {'minute': 2})
+
+        self.assertEqual([limiter._try_acquire(1000.0) for _ in range(3)], [0, 0, 20.0])
+        self.assertEqual(limiter._try_acquire(1020.0), 0)
+
+    def test_rejected_send_is_not_counted(self):
+        limiter = RateLimiter('noreply@example.com', {'second': 10, 'minute': 1})
+        limiter._try_acquire(1000.0)
+
+        self.assertGreater(limiter._try_acquire(1001.0), 0)
+        self.assertEqual(cache.get('email_rate:noreply@example.com:second:1001'), 0)
+
+    def test_reserved_share_is_left_to_others(self):
+        newsletters = RateLimiter('noreply@example.com', {'minute': 10}, reserve=0.2)
+        transactional = RateLimiter('noreply@example.com', {'minute': 10})
+
+        self.assertEqual(newsletters.limits, {'minute': 8})
+        self.assertEqual([newsletters._try_acquire(1000.0) for _ in range(9)].count(0), 8)
+        self.assertEqual([transactional._try_acquire(1000.0) for _ in range(3)], [0, 0, 20.0])
+
+    @override_settings(EMAIL_RATE_MAX_WAIT=0)
+    def test_long_wait_is_refused(self):
+        limiter = RateLimiter('noreply@example.com', {'minute': 1})
+        limiter.acquire()
+
+        with self.assertRaises(RateLimitExceeded):
+            limiter.acquire()
+
+    def test_no_limits(self):
+        limiter = RateLimiter('noreply@example.com', {'second': 0, 'day': 0})
+
+        self.assertEqual(limiter.limits, {})
+        self.assertEqual(limiter.try_acquire(), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AdaptiveConcurrencyTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create(self, window=None):
+        if window is not None:
+            set_concurrency_window('noreply@example.com', window)
+        return AdaptiveConcurrency('noreply@example.com', maximum=4, target_latency=1)
+
+    def test_window_grows_while_sends_are_fast(self):
+        concurrency = self.create()
+        for _ in range(20):
+            concurrency.record(0.1, deferred=False)
+
+        self.assertEqual(concurrency.window, 4)
+        self.assertEqual(get_concurrency_window('noreply@example.com'), 4)
+
+    def test_slow_sends_do_not_grow_window(self):
+        concurrency = self.create()
+        concurrency.record(2, deferred=False)
+
+        self.assertEqual(concurrency.window, 1)
+
+    def test_deferral_halves_window_once_per_target_latency(self):
+        concurrency = self.create(window=4)
+        concurrency.record(0.1, deferred=True)
+        concurrency.record(0.1, deferred=True)
+
+        self.assertEqual(concurrency.window, 2)
+        self.assertEqual(get_concurrency_window('noreply@example.com'), 2)
+
+    def test_saved_window_is_bounded_by_maximum(self):
+        self.assertEqual(self.create(window=10).window, 4)
+
+    def test_acquire_waits_for_free_place(self):
+        concurrency = self.create()
+        concurrency.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (concurrency.acquire(), acquired.set()))
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.1))
+        concurrency.release()
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+
+@override_settings(NEWSLETTER_CLAIM_LIMIT=10, NEWSLETTER_LEASE_SECONDS=15)
+class ClaimOutboxTasksTestCase(TestCase):
+    def setUp(self):
+        message = Message.objects.create(subject='Новости', content='Текст')
+        newsletter = Newsletter.objects.create(name='Новости', start_date=datetime.date.today(), message=message)
+        log = Log.objects.create(newsletter=newsletter, status=Log.STATUS_LOG[2][0])
+        self.tasks = OutboxTask.objects.bulk_create([
+            OutboxTask(log=log, newsletter=newsletter, next_attempt_at=timezone.now(), recipients=[])
+            for _ in range(6)])
+
+    def test_shards_claim_disjoint_tasks(self):
+        now = timezone.now()
+        claimed = [{task.pk for task in claim_outbox_tasks(now, shard=(index, 3))} for index in range(3)]
+
+        for index, pks in enumerate(claimed):
+            self.assertEqual(len(pks), 2)
+            self.assertTrue(all(pk % 3 == index for pk in pks))
+        self.assertEqual(set.union(*claimed), {task.pk for task in self.tasks})
+
+    def test_claimed_tasks_are_leased(self):
+        now = timezone.now()
+        claimed = claim_outbox_tasks(now, shard=(0, 2))
+
+        self.assertEqual(claim_outbox_tasks(now, shard=(0, 2)), [])
+        leased = OutboxTask.objects.filter(pk__in=[task.pk for task in claimed])
+        self.assertTrue(all(task.next_attempt_at == now + datetime.timedelta(seconds=15) for task in leased))
+        self.assertEqual(len(claim_outbox_tasks(now + datetime.timedelta(seconds=15), shard=(0, 2))), len(claimed))
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('1/4'), (1, 4))
+        for value in ('4/4', '-1/4', '1', 'a/b'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(value)
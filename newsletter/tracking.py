@@ -0,0 +1,165 @@
+import datetime
+import re
+
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from django.utils.html import escape
+
+from newsletter.caching import CacheLock
+from newsletter.links import get_site_url_format
+from newsletter.models import Engagement, Newsletter
+from newsletter.queues import CacheQueue
+
+TRACKING_SALT = 'newsletter.tracking'
+# Ссылки в тексте письма, которые заменяются ссылками учета переходов; знаки препинания в конце не входят в ссылку
+LINK_RE = re.compile(r'https?://[^\s<>"\'{}]*[^\s<>"\'{}.,;:!?)\]]')
+# Прозрачный GIF 1x1, которым отвечает ссылка учета открытий
+OPEN_PIXEL = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00' \
+             b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+# HTML-версия письма с пикселем учета открытий: текст письма с кликабельными ссылками
+HTML_BODY = '<html><body><div style="white-space: pre-wrap">{body}</div>' \
+            '<img src="{pixel_url}" width="1" height="1" alt=""></body></html>'
+
+OPEN, CLICK = 'open', 'click'
+
+# Счетчики событий в кеше по виду, рассылке и дню, еще не перенесенные в Engagement
+TRACKING_COUNTERS = 'tracking'
+# Новые счетчики, о которых еще не знает flush_tracking()
+counter_queue = CacheQueue('tracking_counter_queue')
+
+
+def get_open_url(newsletter_id):
+    """Ссылка пикселя учета открытий; одна на рассылку, поэтому не делает текст письма персональным"""
+    token = signing.Signer(salt=TRACKING_SALT).sign(str(newsletter_id))
+    return get_site_url_format('newsletter:track_open').format(token=token)
+
+
+def get_click_url(newsletter_id, url):
+    """Ссылка учета перехода, перенаправляющая на url"""
+    token = signing.Signer(salt=TRACKING_SALT).sign_object([newsletter_id, url], compress=True)
+    return get_site_url_format('newsletter:track_click').format(token=token)
+
+
+def get_opened_newsletter(token):
+    """Рассылка из токена пикселя или None, если подпись неверна"""
+    try:
+        return int(signing.Signer(salt=TRACKING_SALT).unsign(token))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def get_clicked_link(token):
+    """Пара (рассылка, ссылка) из токена перехода или None, если подпись неверна"""
+    try:
+        newsletter_id, url = signing.Signer(salt=TRACKING_SALT).unsign_object(token)
+    except (signing.BadSignature, ValueError):
+        return None
+    return newsletter_id, url
+
+
+def track_links(content, newsletter_id):
+    """Замена ссылок в тексте письма ссылками учета переходов.
+
+    Ссылки с подстановками ({{ email }}) различаются у получателей и остаются как есть.
+    """
+    def replace(match):
+        if content.startswith('{', match.end()):
+            return match.group()
+        return get_click_url(newsletter_id, match.group())
+
+    return LINK_RE.sub(replace, content)
+
+
+def render_html(body, pixel_url):
+    """HTML-версия текста письма с пикселем учета открытий"""
+    body = LINK_RE.sub(lambda match: f'<a href="{match.group()}">{match.group()}</a>', escape(body))
+    return HTML_BODY.format(body=body, pixel_url=pixel_url)
+
+
+def get_counter_key(kind, newsletter_id, date):
+    return f'{TRACKING_COUNTERS}:{kind}:{newsletter_id}:{date.isoformat()}'
+
+
+def record_event(kind, newsletter_id):
+    """Учет открытия или перехода счетчиком в кеше; в БД счетчики переносит flush_tracking().
+
+    События суммируются в Redis по рассылке и дню, поэтому посещение - один атомарный incr. Новый счетчик
+    регистрируется в очереди, из которой flush_tracking() узнает, какие счетчики переносить.
+    """
+    key = get_counter_key(kind, newsletter_id, timezone.localdate())
+    try:
+        cache.incr(key)
+    except ValueError:
+        if cache.add(key, 0, timeout=None):
+            counter_queue.push(key)
+        cache.incr(key)
+
+
+def save_events(counts):
+    """Прибавление событий {(вид, рассылка, дата): количество} к Engagement: недостающие строки создаются
+    одним bulk_create, счетчики всех строк увеличиваются одним UPDATE"""
+    newsletter_ids = set(Newsletter.objects.filter(pk__in={newsletter_id for kind, newsletter_id, date in counts})
+                         .values_list('pk', flat=True))
+    keys = {(newsletter_id, date) for kind, newsletter_id, date in counts if newsletter_id in newsletter_ids}
+    if not keys:
+        return
+
+    def increment(kind):
+        return Case(*[When(newsletter_id=newsletter_id, date=date, then=Value(count))
+                      for (event_kind, newsletter_id, date), count in counts.items()
+                      if event_kind == kind and (newsletter_id, date) in keys], default=Value(0))
+
+    with transaction.atomic():
+        Engagement.objects.bulk_create([Engagement(newsletter_id=newsletter_id, date=date)
+                                        for newsletter_id, date in keys], ignore_conflicts=True)
+        condition = Q()
+        for newsletter_id, date in keys:
+            condition |= Q(newsletter_id=newsletter_id, date=date)
+        Engagement.objects.filter(condition).update(opens=F('opens') + increment(OPEN),
+                                                    clicks=F('clicks') + increment(CLICK))
+
+
+def flush_tracking():
+    """Перенос счетчиков открытий и переходов из кеша в Engagement; возвращает количество перенесенных событий.
+
+    Перенесенное количество вычитается из счетчика атомарным decr, поэтому события, учтенные во время переноса,
+    не теряются. Счетчики прошедших дней без новых событий удаляются. Переносом занимается один процесс за раз.
+    """
+    lock = CacheLock(TRACKING_COUNTERS, timeout=60)
+    if not lock.acquire():
+        return 0
+    try:
+        keys = cache.get(f'{TRACKING_COUNTERS}:keys', set())
+
+        def register(new_keys):
+            keys.update(new_keys)
+            cache.set(f'{TRACKING_COUNTERS}:keys', keys, timeout=None)
+
+        counter_queue.consume(register)
+        values = cache.get_many(keys)
+        counts = {}
+        for key, value in values.items():
+            if value:
+                kind, newsletter_id, date = key.split(':')[1:]
+                counts[kind, int(newsletter_id), datetime.date.fromisoformat(date)] = value
+                cache.decr(key, value)
+        try:
+            save_events(counts)
+        except Exception:
+            for (kind, newsletter_id, date), value in counts.items():
+                cache.incr(get_counter_key(kind, newsletter_id, date), value)
+            raise
+
+        today = timezone.localdate().isoformat()
+        stale = {key for key in keys if not values.get(key) and key.rsplit(':', 1)[-1] < today}
+        if stale:
+            # Событие, учтенное после удаления счетчика, создаст и зарегистрирует его заново
+            cache.delete_many(stale)
+            keys -= stale
+            cache.set(f'{TRACKING_COUNTERS}:keys', keys, timeout=None)
+    finally:
+        lock.release()
+    return sum(counts.values())
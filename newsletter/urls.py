@@ -26,5 +26,9 @@ urlpatterns = [
     path('newsletter/<int:pk>/toggle_activity', toggle_activity, name='newsletter_toggle_activity'),
     path('log/', LogListView.as_view(), name='log'),
     path('log/<int:pk>/', get_newsletter_log, name='newsletter_log'),
-    path('contacts/', ContactsView.as_view(), name='contacts')
+    path('contacts/', ContactsView.as_view(), name='contacts'),
+    path('metrics/', get_metrics, name='metrics'),
+    path('unsubscribe/<str:token>/', unsubscribe, name='unsubscribe'),
+    path('track/open/<str:token>/', track_open, name='track_open'),
+    path('track/click/<str:token>/', track_click, name='track_click'),
 ]
@@ -2,14 +2,22 @@ from django.contrib import messages
 from django.contrib.auth.decorators import permission_required, login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 
-from django.http import Http404
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404, redirect
+from django.db.models import Sum
 from django.urls import reverse_lazy, reverse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import CreateView, UpdateView, ListView, DetailView, DeleteView, TemplateView
 
+from newsletter.dashboard import get_dashboard_counters
 from newsletter.forms import NewsletterForm, MessageForm, ClientForm
 from newsletter.models import Newsletter, Message, Client, Log
+from newsletter.metrics import render_prometheus
 from newsletter.services import get_random_blog_article
+from newsletter.suppression import enqueue_unsubscribe, get_unsubscribe_email
+from newsletter.tracking import CLICK, OPEN, OPEN_PIXEL, get_clicked_link, get_opened_newsletter, record_event
 
 
 class UserQuerysetMixin:
@@ -62,11 +70,12 @@ class LoginRequiredMessageMixin(LoginRequiredMixin):
 
 
 def index(request):
+    counters = get_dashboard_counters()
     return render(request, 'newsletter/index.html', context=
     {
-        'all_newsletter': Newsletter.objects.count(),
-        'active_newsletter': Newsletter.objects.filter(is_active=True).count(),
-        'clients': Client.objects.all().values('email').distinct().count(),
+        'all_newsletter': counters['newsletters'],
+        'active_newsletter': counters['active_newsletters'],
+        'clients': counters['client_emails'],
         'blog_list': get_random_blog_article()
     }
                   )
@@ -120,6 +129,11 @@ class NewsletterDetailView(LoginRequiredMessageMixin, PermissionRequiredMixin, S
     model = Newsletter
     permission_required = 'newsletter.view_newsletter'
 
+    def get_context_data(self, **kwargs):
+        context_data = super().get_context_data(**kwargs)
+        context_data['engagement'] = self.object.engagement.aggregate(opens=Sum('opens'), clicks=Sum('clicks'))
+        return context_data
+
 
 class NewsletterDeleteView(LoginRequiredMessageMixin, PermissionRequiredMixin, UserObjectMixin, DeleteView):
     model = Newsletter
@@ -229,3 +243,55 @@ def get_newsletter_log(request, pk):
         'name': newsletter.name
     }
     return render(request, 'newsletter/newsletter_logs.html', context=context)
+
+
+def get_metrics(request):
+    """Метрики отправки рассылок в формате Prometheus: для персонала или по токену NEWSLETTER_METRICS_TOKEN"""
+    token = settings.NEWSLETTER_METRICS_TOKEN
+    authorized = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@csrf_exempt
+def unsubscribe(request, token):
+    """Отписка по ссылке из письма.
+
+    Адрес берется из подписанного токена, поэтому страница не обращается к БД, а отписка ставится в очередь в кеше
+    и переносится в список исключений пачками. GET показывает кнопку подтверждения (ссылки в письмах открывают
+    и почтовые сканеры), POST отписывает, в том числе в один клик из почтового клиента (RFC 8058).
+    """
+    email = get_unsubscribe_email(token)
+    if email is None:
+        raise Http404
+    if request.method == 'POST':
+        enqueue_unsubscribe(email)
+    return render(request, 'newsletter/unsubscribe.html', {'email': email, 'done': request.method == 'POST'})
+
+
+def track_open(request, token):
+    """Пиксель учета открытий письма.
+
+    Рассылка берется из подписанного токена, а открытие ставится в буфер в кеше, поэтому ответ не обращается к БД.
+    Пиксель возвращается и с неверным токеном, чтобы письмо не показывало битую картинку.
+    """
+    newsletter_id = get_opened_newsletter(token)
+    if newsletter_id is not None:
+        record_event(OPEN, newsletter_id)
+    response = HttpResponse(OPEN_PIXEL, content_type='image/gif')
+    response['Cache-Control'] = 'no-store, max-age=0'
+    return response
+
+
+def track_click(request, token):
+    """Учет перехода по ссылке из письма и перенаправление на нее.
+
+    Ссылка входит в подписанный токен, поэтому перенаправить через эту страницу на произвольный адрес нельзя.
+    """
+    clicked = get_clicked_link(token)
+    if clicked is None:
+        raise Http404
+    newsletter_id, url = clicked
+    record_event(CLICK, newsletter_id)
+    return HttpResponseRedirect(url)
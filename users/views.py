@@ -8,14 +8,12 @@ from django.contrib.auth.models import Group, Permission
 from django.contrib.messages.views import SuccessMessageMixin
 from django.shortcuts import get_object_or_404
 from django.views.generic import ListView
-from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.mail import send_mail
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, UpdateView
 
-from newsletter.services import add_users_group_permissions
+from newsletter.services import add_users_group_permissions, send_transactional_mail
 from users.forms import UserRegisterForm, UserProfileForm
 from users.models import User
 
@@ -40,11 +38,10 @@ class RegisterView(SuccessMessageMixin, CreateView):
         url = 'http://127.0.0.1:8000/users/verify/' + token
 
         if form.is_valid():
-            send_mail(
+            send_transactional_mail(
                 subject='Подтверждение регистрации',
                 message=f"""Для подтверждения регистрации и присоединении к команде перейдите по ссылке: {url}
                         Внимание! Если вы не понимаете, почему Вам пришло это письмо, просто проигнорируйте его""",
-                from_email=settings.EMAIL_HOST_USER,
                 recipient_list=[self.object.email]
             )
         return super().form_valid(form)
@@ -84,10 +81,9 @@ def reset_password(request):
             password = User.objects.make_random_password()
             user.set_password(password)
             user.save(update_fields=['password'])
-            send_mail(
+            send_transactional_mail(
                 subject='Сброс пароля',
                 message=f'''Вы успешно сбросили пароль для аккаунта {input_email}.\n Ваш новый пароль: {password}''',
-                from_email=settings.EMAIL_HOST_USER,
                 recipient_list=[input_email]
             )
         else: